@@ -0,0 +1,114 @@
+"""Generate synthetic ledgers and message corpora for the benchmarks.
+
+    python benchmarks/generate.py --rows 100000 --ledger expenses.json --messages messages.txt
+"""
+import argparse
+import datetime
+import json
+import random
+
+DESCRIPTIONS = [
+    "coffee", "lunch", "dinner", "groceries", "rent", "taxi", "bus ticket", "train ticket",
+    "gas", "electricity bill", "water bill", "internet", "phone bill", "netflix", "spotify",
+    "gym membership", "pharmacy", "doctor", "haircut", "books", "movie tickets", "concert",
+    "birthday gift", "flowers", "pizza", "sushi", "burgers", "beer", "wine", "snacks",
+    "laundry", "cleaning supplies", "parking", "car insurance", "car repair", "new shoes",
+    "jacket", "headphones", "phone case", "charger", "printer ink", "stamps", "donation",
+    "dentist", "vet", "dog food", "cat litter", "hotel", "flight", "museum",
+]
+
+# Common descriptions are much more frequent than rare ones
+WEIGHTS = [1.0 / (rank + 1) for rank in range(len(DESCRIPTIONS))]
+
+MESSAGE_TEMPLATES = [
+    "spent {amount} on {description} {day}",
+    "I paid ${amount} for {description}",
+    "{description} {amount}",
+    "{description} ${amount} {day}",
+    "I spent {amount} dollars on {description} {day}",
+    "{date} {description} {amount}",
+    "bought {description} for ${amount} on {weekday}",
+    # Shapes the regex fast path rejects, these exercise the NLP fallback
+    "{description} for the team cost {amount} and tip 2",
+    "Paid {amount} to John for {description} last week",
+]
+
+DAYS = ["today", "yesterday", "last night", ""]
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def random_amount(rng):
+    # Log-normal, mostly small purchases with the occasional large one
+    return "{:.2f}".format(min(5000.0, rng.lognormvariate(2.5, 1.0)))
+
+
+def generate_ledger(rows, seed=0, years=3, deleted_ratio=0.05, today=None):
+    """Return a list of expenses.json records spread over the last few years."""
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    first_day = today - datetime.timedelta(days=365 * years)
+    span = (today - first_day).days
+
+    ordinals = sorted(first_day.toordinal() + rng.randrange(span + 1) for _ in range(rows))
+    descriptions = rng.choices(DESCRIPTIONS, weights=WEIGHTS, k=rows)
+
+    return [
+        {
+            "date": datetime.date.fromordinal(ordinal).isoformat(),
+            "description": description,
+            "amount": random_amount(rng),
+            "deleted": rng.random() < deleted_ratio,
+        }
+        for ordinal, description in zip(ordinals, descriptions)
+    ]
+
+
+def generate_messages(count, seed=0, today=None):
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    messages = []
+
+    for _ in range(count):
+        template = rng.choice(MESSAGE_TEMPLATES)
+        date = today - datetime.timedelta(days=rng.randrange(365))
+        message = template.format(
+            amount=random_amount(rng),
+            description=rng.choices(DESCRIPTIONS, weights=WEIGHTS)[0],
+            day=rng.choice(DAYS),
+            date=date.isoformat(),
+            weekday=rng.choice(WEEKDAYS),
+        )
+        messages.append(" ".join(message.split()))
+
+    return messages
+
+
+def write_ledger(records, file_path):
+    with open(file_path, 'w') as file:
+        json.dump(records, file)
+
+
+def write_messages(messages, file_path):
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("\n".join(messages) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--ledger", default="expenses.json")
+    parser.add_argument("--messages", default=None, help="also write a message corpus to this file")
+    parser.add_argument("--message-count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_ledger(generate_ledger(args.rows, args.seed), args.ledger)
+    print("Wrote {} expenses to {}".format(args.rows, args.ledger))
+
+    if args.messages:
+        write_messages(generate_messages(args.message_count, args.seed), args.messages)
+        print("Wrote {} messages to {}".format(args.message_count, args.messages))
+
+
+if __name__ == "__main__":
+    main()
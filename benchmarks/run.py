@@ -0,0 +1,234 @@
+"""Headless benchmarks for the expense engine, results are written as JSON.
+
+    python benchmarks/run.py --rows 10000 100000 --output bench.json
+
+Everything runs against the same ledger, parser and export code the window
+uses, without creating a Tk window.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+import export
+import nlp
+import parsing
+from instrumentation import metrics
+from generate import generate_ledger, generate_messages, write_ledger
+from engine import open_ledger
+from sqlite_store import SQLiteLedger
+from totals import period_range
+
+BACKENDS = ("log", "sqlite")
+
+
+def summarize(name, timings, **extra):
+    timings = sorted(timings)
+    total = sum(timings)
+    result = {
+        "name": name,
+        "count": len(timings),
+        "total_seconds": total,
+        "mean_ms": total / len(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "min_ms": timings[0] * 1000,
+        "ops_per_second": len(timings) / total if total else None,
+    }
+    result.update(extra)
+    return result
+
+
+def format_result(result):
+    if "skipped" in result:
+        return "skipped"
+    if "megabytes" in result:
+        return "{:.1f} MB".format(result["megabytes"])
+
+    return "{:.3f} ms".format(result["median_ms"])
+
+
+def measure(name, function, repeat=5, **extra):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return summarize(name, timings, **extra)
+
+
+def measure_each(name, function, items, **extra):
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - start)
+
+    return summarize(name, timings, **extra)
+
+
+def open_backend(backend):
+    if backend == "sqlite":
+        ledger = SQLiteLedger("expenses.db")
+        ledger.migrate_from_json("expenses.json")
+        return ledger
+
+    return open_ledger("log")
+
+
+def bench_ledger(backend, records, writes, repeat):
+    results = []
+
+    # First open migrates expenses.json, later opens only read the store
+    write_ledger(records, "expenses.json")
+    start = time.perf_counter()
+    ledger = open_backend(backend)
+    results.append(summarize("load.migrate", [time.perf_counter() - start]))
+    ledger.close()
+
+    if os.path.exists("expenses.json.migrated"):
+        os.replace("expenses.json.migrated", "expenses.json")
+
+    def reopen():
+        open_backend(backend).close()
+
+    results.append(measure("load.open", reopen, repeat))
+
+    if backend == "log":
+        # Cold start without the binary snapshot, replaying the whole log
+        timings = []
+        for _ in range(repeat):
+            os.remove("expenses.log.snapshot")
+            start = time.perf_counter()
+            ledger = open_backend(backend)
+            timings.append(time.perf_counter() - start)
+            ledger.close()
+        results.append(summarize("load.open_replay", timings))
+
+    ledger = open_backend(backend)
+    today = datetime.date.today()
+
+    # Only the log backend keeps the ledger in memory
+    if hasattr(ledger, "memory_usage"):
+        usage = ledger.memory_usage()
+        results.append({"name": "memory.per_million_rows", "megabytes": usage["per_million_rows"] / 1e6, "columns": usage})
+
+    for period in ("day", "week", "month", "year"):
+        start_date, end_date = period_range(period, today)
+        results.append(measure("view." + period, lambda: ledger.view(start_date, end_date, period=period), repeat))
+
+    results.append(measure("view.range_90_days", lambda: ledger.view(today - datetime.timedelta(days=90), today), repeat))
+    results.append(measure("view.all", lambda: ledger.view(), repeat))
+    results.append(measure("view.deleted", lambda: ledger.view(deleted=True), repeat))
+    results.append(measure("breakdown.month", lambda: ledger.group_by("month"), repeat))
+    results.append(measure("breakdown.description", lambda: ledger.by_description(), repeat))
+
+    expense_ids = []
+    results.append(measure_each("write.add", lambda index: expense_ids.append(ledger.add(today.isoformat(), "benchmark", "1.00")), range(writes)))
+    results.append(measure_each("write.delete", ledger.delete, expense_ids))
+    results.append(measure_each("write.restore", ledger.restore, expense_ids))
+
+    rows = ledger.view()[0]
+    for file_format in ("csv", "jsonl", "xlsx", "parquet"):
+        file_path = "export." + file_format
+        try:
+            results.append(measure("export." + file_format, lambda: export.export_records(export.ledger_records(ledger, rows), file_path, file_format, export.LEDGER_COLUMNS), 1, exported_rows=len(rows)))
+        except RuntimeError as error:
+            results.append({"name": "export." + file_format, "skipped": str(error)})
+
+    ledger.close()
+    return results
+
+
+def bench_parsing(messages):
+    results = []
+    errors = 0
+
+    def interpret(message):
+        nonlocal errors
+        try:
+            parsing.interpret_message(message)
+        except nlp.MissingNLTKData:
+            errors += 1
+
+    parsing.message_cache.clear()
+    parsing.date_cache.clear()
+    hits = parsing.fast_parser.hits
+    misses = parsing.fast_parser.misses
+
+    cold = measure_each("parse.interpret_message", interpret, messages)
+    fast_path_hits = parsing.fast_parser.hits - hits
+    fast_path_misses = parsing.fast_parser.misses - misses
+    cold["fast_path_hit_rate"] = fast_path_hits / (fast_path_hits + fast_path_misses) if messages else 0.0
+    cold["nlp_unavailable"] = errors
+    results.append(cold)
+
+    # Second pass is answered by the message cache, its stats are taken once it is done
+    hits = parsing.message_cache.hits
+    misses = parsing.message_cache.misses
+    cached = measure_each("parse.interpret_message_cached", interpret, messages)
+    cached["cache"] = parsing.cache_stats()
+    cache_hits = parsing.message_cache.hits - hits
+    cache_misses = parsing.message_cache.misses - misses
+    cached["message_cache_hit_rate"] = cache_hits / (cache_hits + cache_misses) if messages else 0.0
+    results.append(cached)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        },
+        "results": [],
+    }
+
+    for rows in args.rows:
+        records = generate_ledger(rows)
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as directory:
+                cwd = os.getcwd()
+                os.chdir(directory)
+                try:
+                    for result in bench_ledger(backend, records, args.writes, args.repeat):
+                        result.update(rows=rows, backend=backend)
+                        report["results"].append(result)
+                        print("{:>8} {:<7} {:<32} {}".format(rows, backend, result["name"], format_result(result)))
+                finally:
+                    os.chdir(cwd)
+
+    for result in bench_parsing(generate_messages(args.messages)):
+        report["results"].append(result)
+        print("{:<49} {:.3f} ms".format(result["name"], result["median_ms"]))
+
+    # Timers recorded inside the engine while the benchmarks ran
+    report["metrics"] = metrics.snapshot()
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print("Wrote {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
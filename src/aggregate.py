@@ -0,0 +1,106 @@
+import datetime
+import numpy as np
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class Aggregator:
+    """Vectorized totals and group-bys over the ledger.
+
+    The ledger columns are converted into a typed DataFrame once per ledger
+    version, every query after that is a single pandas/NumPy pass. Amounts
+    are converted into the base currency. Plain totals only need the cents
+    array, so pandas isn't imported until a breakdown is requested.
+    """
+
+    # Weeks are keyed like the running totals, "2024-W05", see totals.period_keys
+    periods = {
+        "day": "D",
+        "month": "M",
+        "year": "Y",
+    }
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.version = None
+        self.frame = None
+        self.amounts_version = None
+        self.amounts = None
+
+    def cents_array(self):
+        self.ledger.refresh()
+        if self.amounts_version != self.ledger.version:
+            # A new array in the base currency, a view would stop the ledger's cents array from growing
+            self.amounts = self.ledger.base_cents()
+            self.amounts_version = self.ledger.version
+
+        return self.amounts
+
+    def data(self):
+        """Return the ledger as a DataFrame, rebuilding it only after changes."""
+        import pandas as pd
+
+        self.ledger.refresh()
+        if self.version != self.ledger.version:
+            ordinals = np.array(self.ledger.ordinals, dtype=np.int64)
+            # Shift to days since the Unix epoch, unparsable dates (ordinal 0) become NaT
+            dates = (ordinals - EPOCH_ORDINAL).astype("datetime64[D]")
+            dates[ordinals == 0] = np.datetime64("NaT")
+
+            self.frame = pd.DataFrame({
+                "id": np.array(self.ledger.ids, dtype=np.int64),
+                "date": pd.to_datetime(dates),
+                "description": pd.Categorical.from_codes(np.array(self.ledger.descriptions.codes), categories=self.ledger.descriptions.values),
+                "amount": self.cents_array() / 100,
+                "deleted": self.ledger.deleted_flags(),
+            })
+            self.version = self.ledger.version
+
+        return self.frame
+
+    def total_cents(self, rows):
+        """Sum the amounts of the given ledger rows in exact integer cents."""
+        cents = self.cents_array()
+        if len(rows) == 0:
+            return 0
+
+        return int(cents[np.asarray(rows, dtype=np.int64)].sum())
+
+    def select(self, rows=None, deleted=False):
+        frame = self.data()
+        if rows is None:
+            return frame[frame["deleted"] == deleted]
+
+        return frame.iloc[np.asarray(rows, dtype=np.int64)]
+
+    def group_by(self, period, rows=None, deleted=False):
+        """Return a DataFrame of (period, count, total) for day, week, month or year."""
+        import pandas as pd
+
+        frame = self.select(rows, deleted)
+        if period == "week":
+            calendar = frame["date"].dt.isocalendar()
+            keys = (calendar["year"].astype(str) + "-W" + calendar["week"].astype(str).str.zfill(2)).where(frame["date"].notna())
+        else:
+            keys = frame["date"].dt.to_period(self.periods[period])
+        grouped = frame.groupby(keys, sort=True)["amount"].agg(["count", "sum"])
+
+        return pd.DataFrame({
+            "period": grouped.index.astype(str),
+            "count": grouped["count"].to_numpy(),
+            "total": grouped["sum"].to_numpy(),
+        })
+
+    def by_description(self, rows=None, deleted=False):
+        """Return a DataFrame of (description, count, total), largest total first."""
+        import pandas as pd
+
+        frame = self.select(rows, deleted)
+        grouped = frame.groupby("description", observed=True)["amount"].agg(["count", "sum"])
+        grouped = grouped.sort_values("sum", ascending=False)
+
+        return pd.DataFrame({
+            "description": grouped.index.astype(str),
+            "count": grouped["count"].to_numpy(),
+            "total": grouped["sum"].to_numpy(),
+        })
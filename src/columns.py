@@ -0,0 +1,109 @@
+import array
+import sys
+import numpy as np
+
+
+class BitArray:
+    """Growable array of booleans packed eight to a byte."""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.length = 0
+
+    @classmethod
+    def from_bytes(cls, bits, length):
+        flags = cls()
+        flags.bits = bytearray(bits)
+        flags.length = length
+        return flags
+
+    def append(self, value):
+        if self.length % 8 == 0:
+            self.bits.append(0)
+        if value:
+            self.bits[self.length >> 3] |= 1 << (self.length & 7)
+        self.length += 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("bit index out of range")
+
+        return bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.length:
+            raise IndexError("bit index out of range")
+
+        if value:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def to_numpy(self):
+        """Return the flags unpacked into a new bool array."""
+        return np.unpackbits(np.frombuffer(bytes(self.bits), dtype=np.uint8), count=self.length, bitorder="little").astype(bool)
+
+    def nbytes(self):
+        return len(self.bits)
+
+
+class DictionaryColumn:
+    """Column of strings where every distinct value is stored once.
+
+    Rows only hold the int32 code of their value, so a ledger that repeats
+    "coffee" and "lunch" keeps two strings no matter how many rows it has.
+    Codes are handed out in order of first appearance.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.value_codes = {}
+        self.codes = array.array("i")
+
+    @classmethod
+    def from_codes(cls, values, codes):
+        column = cls()
+        column.values = values
+        column.value_codes = {value: code for code, value in enumerate(values)}
+        column.codes = codes
+        return column
+
+    def append(self, value):
+        code = self.value_codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.value_codes[value] = code
+
+        self.codes.append(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __iter__(self):
+        values = self.values
+        for code in self.codes:
+            yield values[code]
+
+    def nbytes(self):
+        return sizeof_array(self.codes) + sys.getsizeof(self.values) + sys.getsizeof(self.value_codes) + sum(sys.getsizeof(value) for value in self.values)
+
+
+def sizeof_array(values):
+    # Element storage only, the array header is the same for any row count
+    return values.itemsize * len(values)
+
+
+def index_array(rows):
+    """Turn a NumPy array of row positions into a compact array('q')."""
+    return array.array("q", np.asarray(rows, dtype=np.int64).tobytes())
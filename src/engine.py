@@ -0,0 +1,84 @@
+import datetime
+import parsing
+from money import BASE_CURRENCY
+from storage import ExpenseStore
+from ledger import Ledger
+from totals import PERIODS, period_range
+
+# Default file for each storage backend
+BACKENDS = {
+    "log": "expenses.log",
+    "sqlite": "expenses.db",
+}
+
+
+def open_ledger(backend="log", file_path=None):
+    file_path = file_path or BACKENDS[backend]
+
+    if backend == "sqlite":
+        from sqlite_store import SQLiteLedger
+
+        return SQLiteLedger(file_path)
+
+    # Open the expense log, importing the old expenses.json the first time
+    store = ExpenseStore(file_path)
+    store.migrate_from_json("expenses.json")
+    return Ledger(store)
+
+
+class ExpenseEngine:
+    """Message parsing, storage and period queries without a display.
+
+    The Tk window and the HTTP server are both thin layers over this. All
+    methods are blocking and the ledger isn't thread-safe, callers run them
+    on a single worker thread.
+    """
+
+    def __init__(self, backend="log", file_path=None, parser=parsing.fast_parser):
+        self.ledger = open_ledger(backend, file_path)
+        self.parser = parser
+
+    def interpret_message(self, message):
+        """Return (date, description, amount, currency) for a free-text message."""
+        return parsing.interpret_message(message, self.parser)
+
+    def add(self, date, description, amount, currency=BASE_CURRENCY):
+        return self.ledger.add(date, description, amount, currency)
+
+    def add_many(self, expenses):
+        """Save (date, description, amount[, currency]) tuples with a single write, return their ids."""
+        return self.ledger.add_many(expenses)
+
+    def add_message(self, message):
+        """Parse and save a message, return (id, (date, description, amount, currency))."""
+        expense = self.interpret_message(message)
+        return self.add(*expense), expense
+
+    def set_deleted_many(self, expense_ids, deleted):
+        return self.ledger.set_deleted_many(expense_ids, deleted)
+
+    def undo(self):
+        return self.ledger.undo()
+
+    def view(self, start_date=None, end_date=None, deleted=False, period=None):
+        """Return (rows, total in base currency cents), see Ledger.view."""
+        return self.ledger.view(start_date, end_date, deleted, period)
+
+    def period_view(self, period, date=None, deleted=False):
+        """Return (rows, total in cents) for the day, week, month or year containing date, today by default."""
+        start_date, end_date = period_range(period, date or datetime.date.today())
+        return self.view(start_date, end_date, deleted, period)
+
+    def totals(self, date=None):
+        """Return the total in base currency cents of the day, week, month and year containing date."""
+        date = date or datetime.date.today()
+        return {period: self.view(*period_range(period, date), period=period)[1] for period in PERIODS}
+
+    def search(self, text, start_date=None, end_date=None, deleted=False):
+        return self.ledger.search(text, start_date, end_date, deleted)
+
+    def records(self, rows):
+        return [self.ledger.record(row) for row in rows]
+
+    def close(self):
+        self.ledger.close()
@@ -0,0 +1,122 @@
+import csv
+import itertools
+import json
+from money import to_cents
+
+COLUMNS = ("Date", "Description", "Amount")
+# Columns of ledger_records, amounts are in the currency they were entered in
+LEDGER_COLUMNS = COLUMNS + ("Currency",)
+
+# Rows written per chunk, bounds memory for every format
+CHUNK_SIZE = 10000
+
+FORMATS = {
+    ".csv": "csv",
+    ".xlsx": "xlsx",
+    ".parquet": "parquet",
+    ".jsonl": "jsonl",
+}
+
+
+def format_for(file_path):
+    for extension, file_format in FORMATS.items():
+        if file_path.lower().endswith(extension):
+            return file_format
+
+    raise ValueError("Unknown export format for {}, use one of {}".format(file_path, ", ".join(FORMATS)))
+
+
+def ledger_records(ledger, rows):
+    """Yield typed (date, description, amount, currency) tuples for ledger rows, see LEDGER_COLUMNS.
+
+    Amounts are exact Decimals, never floats.
+    """
+    for row in rows:
+        yield ledger.record_values(row)
+
+
+def chunks(records):
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_records(records, file_path, file_format=None, columns=COLUMNS):
+    """Stream records to file_path in csv, xlsx, parquet or jsonl, return the row count."""
+    file_format = file_format or format_for(file_path)
+    writers = {
+        "csv": write_csv,
+        "xlsx": write_xlsx,
+        "parquet": write_parquet,
+        "jsonl": write_jsonl,
+    }
+
+    return writers[file_format](records, file_path, columns)
+
+
+def write_csv(records, file_path, columns):
+    count = 0
+    with open(file_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for chunk in chunks(records):
+            writer.writerows(chunk)
+            count += len(chunk)
+
+    return count
+
+
+def write_jsonl(records, file_path, columns):
+    keys = [column.lower() for column in columns]
+    count = 0
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for chunk in chunks(records):
+            # Decimal amounts are written as strings so no digits are lost
+            file.write("".join(json.dumps(dict(zip(keys, record)), default=str) + "\n" for record in chunk))
+            count += len(chunk)
+
+    return count
+
+
+def write_xlsx(records, file_path, columns):
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("Excel export needs openpyxl, install it with 'pip install openpyxl'") from None
+
+    # Write-only workbooks stream rows to disk instead of keeping every cell in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Expenses")
+    sheet.append(columns)
+
+    count = 0
+    for record in records:
+        sheet.append(record)
+        count += 1
+
+    workbook.save(file_path)
+    return count
+
+
+def write_parquet(records, file_path, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow, install it with 'pip install pyarrow'") from None
+
+    # The third column is the amount, stored as integer cents, every other one is text
+    schema = pa.schema([(column + "Cents", pa.int64()) if index == 2 else (column, pa.string()) for index, column in enumerate(columns)])
+
+    count = 0
+    with pq.ParquetWriter(file_path, schema) as writer:
+        for chunk in chunks(records):
+            values = [list(column) for column in zip(*chunk)]
+            values[2] = [to_cents(amount) for amount in values[2]]
+            writer.write_batch(pa.record_batch(values, schema=schema))
+            count += len(chunk)
+
+    return count
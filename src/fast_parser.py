@@ -0,0 +1,128 @@
+import datetime
+import re
+from money import AMOUNT_PATTERN, BASE_CURRENCY, find_currency, match_currency, normalize_amount
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+RELATIVE_DAYS = {
+    "today": 0,
+    "tonight": 0,
+    "this morning": 0,
+    "this afternoon": 0,
+    "this evening": 0,
+    "yesterday": 1,
+    "last night": 1,
+    "day before yesterday": 2,
+    "the day before yesterday": 2,
+}
+
+ISO_DATE_PATTERN = re.compile(r"(?<![\w-])(?:on\s+)?(?P<date>\d{4}-\d{2}-\d{2})(?![\w-])", re.IGNORECASE)
+RELATIVE_DATE_PATTERN = re.compile(
+    r"\b(?:on\s+)?(?P<relative>" + "|".join(sorted(RELATIVE_DAYS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+WEEKDAY_PATTERN = re.compile(
+    r"\b(?:(?P<modifier>last|this|on)\s+)?(?P<weekday>" + "|".join(WEEKDAYS) + r")\b",
+    re.IGNORECASE,
+)
+LEADING_WORDS_PATTERN = re.compile(r"^(?:i\s+)?(?:just\s+)?(?:spent|paid|sent|bought|spend|pay|got)\b\s*", re.IGNORECASE)
+EDGE_WORDS_PATTERN = re.compile(r"^(?:(?:on|for|at|to|in)\s+)+|(?:\s+(?:on|for|at|to|in))+$", re.IGNORECASE)
+DESCRIPTION_PATTERN = re.compile(r"^[^\W\d_]+(?:[\s'&-]+[^\W\d_]+)*$")
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+# Date words the patterns above don't resolve, e.g. "last month", "tomorrow", "next friday" or "in march"
+DATE_WORDS_PATTERN = re.compile(
+    r"\b(?:last|next|this|ago|tomorrow|weekend|weeks?|months?|years?|" + "|".join(MONTHS) + r"|"
+    + "|".join(month[:3] for month in MONTHS) + r"|sept)\b",
+    re.IGNORECASE,
+)
+
+
+class FastParser:
+    """Regex fast path for the common message shapes.
+
+    Handles an amount with an optional currency symbol, code or word, an
+    optional ISO date, relative day word or weekday name, and a short
+    description, e.g. "spent 12.50 on lunch yesterday" or "€12,50 lunch".
+    Any other date word, like "last month" or "next friday", is left to
+    the NLTK pipeline.
+    parse returns (date, description, amount, currency), or None whenever
+    the message doesn't fit so the caller can fall back to the NLTK pipeline.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def parse(self, message, today=None):
+        result = self.match(message.strip(), today or datetime.date.today())
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def match(self, message, today):
+        date_value, message = self.match_date(message, today)
+        if date_value is False:
+            return None
+
+        amounts = list(AMOUNT_PATTERN.finditer(message))
+        if len(amounts) != 1:
+            return None
+
+        amount_match = amounts[0]
+        amount = normalize_amount(amount_match.group("amount"))
+        description = message[:amount_match.start()] + " " + message[amount_match.end():]
+
+        description = " ".join(description.split())
+        description = LEADING_WORDS_PATTERN.sub("", description)
+        description = EDGE_WORDS_PATTERN.sub("", description.strip(" ,.!")).strip(" ,.!")
+
+        # Anything we don't fully understand goes through the NLP path
+        if not DESCRIPTION_PATTERN.match(description):
+            return None
+
+        # Date words left in the description mean the date above is wrong
+        if DATE_WORDS_PATTERN.search(description):
+            return None
+
+        # A currency away from the amount, e.g. "12 on lunch in euros", is left to the NLP path too
+        if find_currency(description):
+            return None
+
+        return date_value, description, amount, match_currency(amount_match) or BASE_CURRENCY
+
+    def match_date(self, message, today):
+        """Return (date, message without the date), date is False if ambiguous."""
+        found = []
+        for pattern in (ISO_DATE_PATTERN, RELATIVE_DATE_PATTERN, WEEKDAY_PATTERN):
+            found.extend((match, pattern) for match in pattern.finditer(message))
+
+        if not found:
+            return today.isoformat(), message
+
+        if len(found) > 1:
+            return False, message
+
+        match, pattern = found[0]
+        if pattern is ISO_DATE_PATTERN:
+            try:
+                date = datetime.date.fromisoformat(match.group("date"))
+            except ValueError:
+                return False, message
+        elif pattern is RELATIVE_DATE_PATTERN:
+            date = today - datetime.timedelta(days=RELATIVE_DAYS[match.group("relative").lower()])
+        else:
+            # Expenses are in the past, so a weekday means the most recent one
+            days_back = (today.weekday() - WEEKDAYS.index(match.group("weekday").lower())) % 7
+            modifier = (match.group("modifier") or "").lower()
+            if modifier == "last" and days_back == 0:
+                days_back = 7
+            date = today - datetime.timedelta(days=days_back)
+
+        return date.isoformat(), message[:match.start()] + " " + message[match.end():]
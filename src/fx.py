@@ -0,0 +1,145 @@
+import csv
+import datetime
+import os
+import numpy as np
+from cache import LRUCache
+from instrumentation import log, metrics
+from money import BASE_CURRENCY
+
+# Exchange rates file, one "date,currency,rate" line per rate
+RATES_PATH = os.environ.get("EXPENSES_RATES", "rates.csv")
+
+
+class RateTable:
+    """Exchange rates into the base currency by date, read from a local CSV file.
+
+    Each line is date,currency,rate where rate is what one unit of the
+    currency was worth in the base currency on that date, e.g.
+    2024-05-01,EUR,1.0712. A header line is allowed.
+
+    Every currency gets two sorted arrays, the date ordinals and the rates,
+    so the rate for a date is the latest one on or before it. Dates before
+    the first rate use the first rate, unparsable dates the latest. Whole
+    columns are converted with one searchsorted per currency, single
+    amounts go through an LRU cache of (currency, date) factors.
+
+    Amounts in a currency without any rate are counted one to one, with a
+    warning the first time.
+    """
+
+    def __init__(self, base=BASE_CURRENCY, file_path=RATES_PATH):
+        self.base = base
+        self.file_path = file_path
+        self.ordinals = {}
+        self.rates = {}
+        # (mtime, size) of the file the rates were read from, saved totals record it
+        self.version = None
+        self.cache = LRUCache(4096)
+        self.warned = set()
+
+    @classmethod
+    @metrics.timed("fx.load")
+    def load(cls, file_path=RATES_PATH, base=BASE_CURRENCY):
+        """Read the rates file, an empty table if there is none."""
+        table = cls(base, file_path)
+        table.version = file_version(file_path)
+        if table.version is None:
+            return table
+
+        rates = {}
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            for line_number, row in enumerate(csv.reader(file), start=1):
+                if not row or row[0].startswith("#"):
+                    continue
+
+                try:
+                    ordinal = datetime.date.fromisoformat(row[0].strip()).toordinal()
+                    currency = row[1].strip().upper()
+                    rate = float(row[2])
+                except (ValueError, IndexError):
+                    # The first line may be a header
+                    if line_number > 1:
+                        log.warning("Ignoring line %d of %s: %s", line_number, file_path, ",".join(row))
+                    continue
+
+                if rate > 0 and np.isfinite(rate):
+                    rates.setdefault(currency, {})[ordinal] = rate
+                else:
+                    log.warning("Ignoring line %d of %s: rate must be positive", line_number, file_path)
+
+        for currency, by_ordinal in rates.items():
+            ordinals = sorted(by_ordinal)
+            table.ordinals[currency] = np.array(ordinals, dtype=np.int32)
+            table.rates[currency] = np.array([by_ordinal[ordinal] for ordinal in ordinals], dtype=np.float64)
+
+        return table
+
+    def changed(self):
+        """Cheap check whether the rates file was edited, added or removed since it was read."""
+        return file_version(self.file_path) != self.version
+
+    def reload(self):
+        return RateTable.load(self.file_path, self.base)
+
+    def key(self):
+        """What totals converted with this table depend on."""
+        return [self.base, self.version]
+
+    def factors(self, currency, ordinals):
+        """Return the float64 factors converting currency into the base currency on each date ordinal."""
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        rates = self.rates.get(currency)
+        if currency == self.base or rates is None:
+            if currency != self.base and currency not in self.warned:
+                log.warning("No exchange rates for %s in %s, counting it one to one", currency, self.file_path)
+                self.warned.add(currency)
+            return np.ones(len(ordinals), dtype=np.float64)
+
+        ordinals = np.where(ordinals == 0, np.iinfo(np.int32).max, ordinals)
+        positions = np.searchsorted(self.ordinals[currency], ordinals, side="right") - 1
+        return rates[np.maximum(positions, 0)]
+
+    def factor(self, currency, ordinal):
+        if currency == self.base:
+            return 1.0
+
+        return self.cache.get_or_compute((currency, ordinal), lambda: float(self.factors(currency, [ordinal])[0]))
+
+    def convert_one(self, cents, currency, ordinal):
+        """Convert an amount in cents into base currency cents, rounding like convert does."""
+        if currency == self.base:
+            return cents
+
+        return int(round(cents * self.factor(currency, ordinal)))
+
+    def convert(self, cents, currency_codes, currencies, ordinals):
+        """Convert a column of cents into base currency cents.
+
+        currency_codes holds the position in currencies of each row's
+        currency, ordinals each row's date. Rows in the base currency are
+        copied as they are.
+        """
+        converted = np.array(cents, dtype=np.int64)
+        if all(currency == self.base for currency in currencies):
+            return converted
+
+        codes = np.asarray(currency_codes)
+        ordinals = np.asarray(ordinals)
+        for code, currency in enumerate(currencies):
+            if currency == self.base:
+                continue
+
+            rows = np.flatnonzero(codes == code)
+            if len(rows):
+                converted[rows] = np.rint(converted[rows] * self.factors(currency, ordinals[rows])).astype(np.int64)
+
+        return converted
+
+
+def file_version(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+
+    return [stat.st_mtime_ns, stat.st_size]
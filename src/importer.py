@@ -0,0 +1,152 @@
+import concurrent.futures
+import csv
+import itertools
+import multiprocessing
+import os
+import parsing
+
+# Column names tried, in order, when importing a CSV with a header row
+MESSAGE_COLUMNS = ("message", "text", "description", "memo")
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.fast_path_hits = 0
+        self.fast_path_misses = 0
+
+    def fast_path_hit_rate(self):
+        """Share of parsed messages the regex fast path understood, cached messages aren't counted."""
+        total = self.fast_path_hits + self.fast_path_misses
+        return self.fast_path_hits / total if total else 0.0
+
+    def add_error(self, line_number, message, error):
+        self.errors.append((line_number, message, error))
+
+    def write(self, file_path):
+        """Write one "line<TAB>message<TAB>error" row per failed line."""
+        with open(file_path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter="\t")
+            writer.writerow(("line", "message", "error"))
+            writer.writerows(self.errors)
+
+
+def count_messages(file_path):
+    """Count the messages read_messages yields, blank lines and a header row aren't messages."""
+    return sum(1 for _ in read_messages(file_path))
+
+
+def read_messages(file_path):
+    """Yield (line number, message) pairs from a text or CSV file."""
+    with open(file_path, 'r', encoding='utf-8', newline='') as file:
+        if not file_path.lower().endswith(".csv"):
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield line_number, line.strip()
+            return
+
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        columns = [column.strip().lower() for column in header]
+        column = next((columns.index(name) for name in MESSAGE_COLUMNS if name in columns), None)
+
+        # Without a known header the first row is data and all fields make up the message
+        if column is None:
+            rows = itertools.chain([header], reader)
+            start = 1
+        else:
+            rows = reader
+            start = 2
+
+        for line_number, row in enumerate(rows, start=start):
+            message = row[column] if column is not None and column < len(row) else " ".join(row)
+            if message.strip():
+                yield line_number, message.strip()
+
+
+def process_pool(workers, initializer=None):
+    """Parse worker pool started with spawn.
+
+    Forking copies the locks other threads hold at that moment (metrics,
+    caches, logging) into the child, which then hangs on its first use.
+    """
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_chunk(chunk):
+    """Parse a chunk in a worker process, return (results, fast path hits, misses)."""
+    hits = parsing.fast_parser.hits
+    misses = parsing.fast_parser.misses
+    results = []
+    for line_number, message in chunk:
+        try:
+            results.append((line_number, message, parsing.interpret_message(message), None))
+        except Exception as error:
+            results.append((line_number, message, None, str(error)))
+
+    return results, parsing.fast_parser.hits - hits, parsing.fast_parser.misses - misses
+
+
+def import_messages(file_path, ledger, workers=None, chunk_size=1000, progress=None):
+    """Stream a file of messages through interpret_message and save them in one write.
+
+    Chunks are parsed in a process pool with at most two chunks per worker in
+    flight, so memory stays bounded by the parsed results rather than the
+    file. progress(done, total) is called after every chunk.
+    """
+    report = ImportReport()
+    total = count_messages(file_path)
+    workers = workers or os.cpu_count() or 1
+    parsed = {}
+    expenses = []
+    done = 0
+
+    def collect(future):
+        nonlocal done
+        results, hits, misses = future.result()
+        report.fast_path_hits += hits
+        report.fast_path_misses += misses
+        for line_number, message, result, error in results:
+            if error is None:
+                parsed[line_number] = result
+            else:
+                report.add_error(line_number, message, error)
+
+        done += len(results)
+        if progress:
+            progress(done, total)
+
+    with process_pool(workers) as executor:
+        pending = set()
+        for chunk in chunked(read_messages(file_path), chunk_size):
+            if len(pending) >= workers * 2:
+                finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    collect(future)
+
+            pending.add(executor.submit(parse_chunk, chunk))
+
+        for future in concurrent.futures.as_completed(pending):
+            collect(future)
+
+    # Keep the file order no matter which chunk finished first
+    for line_number in sorted(parsed):
+        expenses.append(parsed[line_number])
+
+    ledger.add_many(expenses)
+    report.imported = len(expenses)
+    report.errors.sort()
+    return report
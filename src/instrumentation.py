@@ -0,0 +1,156 @@
+import collections
+import logging
+import threading
+import time
+
+log = logging.getLogger("expenses")
+
+
+class Metrics:
+    """Named timers and counters for the hot paths.
+
+    Timers keep the last `samples` durations per name so percentiles reflect
+    recent behaviour, plus an all-time count and total.
+    """
+
+    samples = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.timer_counts = collections.Counter()
+        self.timer_totals = collections.Counter()
+        self.counters = collections.Counter()
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = collections.deque(maxlen=self.samples)
+            self.durations[name].append(seconds)
+            self.timer_counts[name] += 1
+            self.timer_totals[name] += seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def timed(self, name):
+        """Decorator version of timer()."""
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                with Timer(self, name):
+                    return function(*args, **kwargs)
+
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+
+        return decorator
+
+    def percentiles(self, name, points=(50, 90, 99)):
+        with self.lock:
+            durations = sorted(self.durations.get(name, ()))
+
+        if not durations:
+            return {}
+
+        return {"p{}".format(point): durations[min(len(durations) - 1, len(durations) * point // 100)] for point in points}
+
+    def snapshot(self):
+        """Return every timer (count, total, percentiles in seconds) and counter."""
+        with self.lock:
+            names = sorted(self.durations)
+            counts = dict(self.timer_counts)
+            totals = dict(self.timer_totals)
+            counters = dict(self.counters)
+
+        timers = {}
+        for name in names:
+            timers[name] = {"count": counts[name], "total": totals[name]}
+            timers[name].update(self.percentiles(name))
+
+        return {"timers": timers, "counters": counters}
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = ["{:<28} {:>8} {:>10} {:>10} {:>10} {:>10}".format("timer", "count", "total ms", "p50 ms", "p90 ms", "p99 ms")]
+        for name, timer in snapshot["timers"].items():
+            lines.append("{:<28} {:>8} {:>10.2f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                name, timer["count"], timer["total"] * 1000, timer["p50"] * 1000, timer["p90"] * 1000, timer["p99"] * 1000))
+
+        lines.append("")
+        lines.append("{:<28} {:>8}".format("counter", "value"))
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("{:<28} {:>8}".format(name, value))
+
+        return "\n".join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.timer_counts.clear()
+            self.timer_totals.clear()
+            self.counters.clear()
+
+
+class Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+# Shared by the whole process
+metrics = Metrics()
+
+
+class Profiler:
+    """Opt-in cProfile and tracemalloc capture around a block of code."""
+
+    def __init__(self, profile_path=None, trace_memory=False, top=20):
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.top = top
+        self.profiler = None
+
+    def __enter__(self):
+        if self.trace_memory:
+            import tracemalloc
+
+            tracemalloc.start()
+
+        if self.profile_path:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            log.warning("Wrote profile to %s, view it with 'python -m pstats %s'", self.profile_path, self.profile_path)
+
+        if self.trace_memory:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            lines = ["Memory: {:.1f} MiB current, {:.1f} MiB peak".format(current / 2 ** 20, peak / 2 ** 20)]
+            lines.extend(str(statistic) for statistic in snapshot.statistics("lineno")[:self.top])
+            log.warning("\n".join(lines))
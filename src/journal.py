@@ -0,0 +1,25 @@
+import collections
+
+
+class UndoJournal:
+    """Bounded history of delete and restore batches, newest last.
+
+    Each batch is the list of ids a single call changed and the deleted
+    flag they were set to, so undoing it is one more batch the other way.
+    """
+
+    def __init__(self, size=100):
+        self.batches = collections.deque(maxlen=size)
+
+    def record(self, expense_ids, deleted):
+        self.batches.append((list(expense_ids), deleted))
+
+    def pop(self):
+        """Return the newest (expense_ids, deleted) batch and forget it, None if there is none."""
+        if not self.batches:
+            return None
+
+        return self.batches.pop()
+
+    def __len__(self):
+        return len(self.batches)
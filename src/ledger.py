@@ -0,0 +1,532 @@
+import array
+import bisect
+import datetime
+import os
+import sys
+import numpy as np
+import fx
+import snapshot
+from aggregate import Aggregator
+from columns import BitArray, DictionaryColumn, index_array, sizeof_array
+from money import BASE_CURRENCY, DEFAULT_CURRENCY, format_cents, to_cents, to_decimal
+from search import SearchIndex
+from storage import expense_fields
+from instrumentation import metrics
+from journal import UndoJournal
+from totals import RunningTotals
+
+
+class Ledger:
+    """Columnar in-memory copy of the expense store shared by all views.
+
+    Writes go through the ledger so the columns are updated in place. What
+    other processes append to the log is applied as a delta, the columns are
+    only rebuilt from scratch when the log was replaced by a compaction.
+
+    Dates are parsed once into int32 ordinals and kept in a sorted index so
+    period views are a bisect plus a slice instead of a scan. Amounts are
+    int64 cents in the currency they were entered in, with running
+    per-period totals in the base currency next to the log. Deleted flags
+    are a bit array, descriptions and currencies are dictionary encoded.
+    Views return arrays of row positions, never copies of the records.
+
+    Totals convert each amount at the exchange rate of its date. The whole
+    cents column is converted in one vectorized pass per ledger version and
+    the running totals are recomputed when the rates file changes.
+
+    Rows are kept in id order, which is the order the log hands ids out in,
+    so an id is found by bisecting the ids. Amounts are shown from the
+    cents, the original date text is only kept for the few rows where it
+    isn't an ISO date. Descriptions get an inverted index for search, built
+    on first use.
+
+    The columns are saved to a binary snapshot next to the log. Opening a
+    ledger copies them back from the snapshot and only replays what was
+    appended to the log after it.
+    """
+
+    # Rewrite the snapshot once this many log lines were written after it
+    snapshot_threshold = 10000
+    # Adding this many rows at once sorts the date index again instead of bisect inserting each row
+    bulk_index_rows = 1000
+
+    def __init__(self, store, rates=None):
+        self.store = store
+        self.rates = rates or fx.RateTable.load()
+        self.ids = array.array("q")
+        self.ordinals = array.array("i")
+        self.cents = array.array("q")
+        self.deleted = BitArray()
+        self.descriptions = DictionaryColumn()
+        self.currencies = DictionaryColumn()
+        self.date_text = {}
+        self.sorted_ordinals = array.array("i")
+        self.sorted_rows = array.array("q")
+        self.totals = RunningTotals()
+        self.totals_path = store.file_path + ".totals"
+        self.snapshot_path = store.file_path + ".snapshot"
+        # Store state the snapshot on disk was written at, None if there is none we can use
+        self.snapshot_state = None
+        # Rates the snapshot's totals were converted with
+        self.snapshot_rates = None
+        self.signature = None
+        # Bumped on every change so derived data knows when to rebuild
+        self.version = 0
+        self._aggregator = None
+        self._search_index = None
+        self._deleted_flags = None
+        self._deleted_flags_version = None
+        # Counts the times refresh() found changes made by other processes
+        self.refreshes = 0
+        self.journal = UndoJournal()
+
+        with store.lock:
+            if not self.load_snapshot():
+                self.store.read_new()
+                self.rebuild()
+
+    def load_snapshot(self):
+        """Restore the columns from the snapshot and catch up with the log, return False if there is no usable snapshot."""
+        saved = snapshot.Snapshot.load(self.snapshot_path, self.store.file_path)
+        if saved is None:
+            return False
+
+        columns = saved.columns
+        self.store.resume(saved.state, os.stat(self.store.file_path).st_ino)
+        self.ids = columns["ids"]
+        self.ordinals = columns["ordinals"]
+        self.cents = columns["cents"]
+        self.deleted = BitArray.from_bytes(columns["deleted"], saved.rows)
+        self.descriptions = DictionaryColumn.from_codes(saved.descriptions, columns["description_codes"])
+        self.currencies = DictionaryColumn.from_codes(saved.currencies, columns["currency_codes"])
+        self.date_text = saved.date_text
+        self.sorted_rows = columns["sorted_rows"]
+        self.sorted_ordinals = columns["sorted_ordinals"]
+        self.totals = RunningTotals()
+        self.totals.totals = saved.totals
+        self.snapshot_state = saved.state
+        self.snapshot_rates = saved.rates
+        self.version += 1
+
+        # Saved totals were converted with the rates of the time, redo them if those changed
+        if saved.rates != self.rates.key():
+            self.totals = self.compute_totals()
+
+        entries = self.store.read_new()
+        if entries is None:
+            self.rebuild()
+        else:
+            self.apply_entries(entries)
+
+        self.signature = self.store.signature()
+        return True
+
+    def snapshot_stale(self):
+        if not self.store.offset:
+            return False
+
+        state = self.snapshot_state
+        if state is None or state["version"] != self.store.version or self.snapshot_rates != self.rates.key():
+            return True
+
+        return self.store.log_lines - state["log_lines"] >= self.snapshot_threshold
+
+    def save_snapshot(self):
+        with self.store.lock:
+            self.refresh()
+            self.snapshot_state = snapshot.save(self.snapshot_path, self)
+            self.snapshot_rates = self.rates.key()
+
+    def update_snapshot(self):
+        """Rewrite the snapshot if it is missing or too far behind the log, return True if it was written."""
+        if not self.snapshot_stale():
+            return False
+
+        self.save_snapshot()
+        return True
+
+    def rebuild(self):
+        # Build into a fresh ledger and swap the columns in at the end, so a
+        # reader on another thread never sees half rebuilt columns
+        fresh = Ledger.__new__(Ledger)
+        fresh.ids = array.array("q")
+        fresh.ordinals = array.array("i")
+        fresh.cents = array.array("q")
+        fresh.deleted = BitArray()
+        fresh.descriptions = DictionaryColumn()
+        fresh.currencies = DictionaryColumn()
+        fresh.date_text = {}
+        fresh.rates = self.rates
+        fresh.version = self.version
+
+        # Ids are handed out in increasing order, so this is already sorted unless the log was edited by hand
+        for record in sorted(self.store.records.values(), key=lambda record: record["id"]):
+            fresh.append_row(record["id"], record["date"], record["description"], record["amount"], record["currency"], record["deleted"], index=False)
+
+        fresh.rebuild_index()
+
+        # Saved totals are only trusted if they were written for this exact log and these rates
+        signature = self.store.signature()
+        fresh.totals = RunningTotals()
+        if not fresh.totals.load(self.totals_path, self.totals_signature(signature)):
+            fresh.totals = fresh.compute_totals()
+
+        for name in ("ids", "ordinals", "cents", "deleted", "descriptions", "currencies", "date_text", "sorted_ordinals", "sorted_rows", "totals"):
+            setattr(self, name, getattr(fresh, name))
+
+        self.signature = signature
+        self.version = fresh.version + 1
+        # Row positions and description codes may have moved, index again on the next search
+        self._search_index = None
+
+    def compute_totals(self):
+        # Sum per day first, there are far fewer days than rows
+        ordinals = np.array(self.ordinals, dtype=np.int64)
+        keep = (ordinals != 0) & ~self.deleted.to_numpy()
+        days, day_of_row = np.unique(ordinals[keep], return_inverse=True)
+        sums = np.zeros(len(days), dtype=np.int64)
+        np.add.at(sums, day_of_row, self.base_cents()[keep])
+
+        totals = RunningTotals()
+        for ordinal, cents in zip(days.tolist(), sums.tolist()):
+            totals.add(datetime.date.fromordinal(ordinal), cents)
+
+        return totals
+
+    def base_cents(self):
+        """Return every amount converted into base currency cents at the rate of its date, as a new int64 array."""
+        with metrics.timer("ledger.convert"):
+            return self.rates.convert(self.cents, self.currencies.codes, self.currencies.values, self.ordinals)
+
+    def totals_signature(self, signature):
+        # Totals depend on the rates they were converted with as much as on the log
+        if signature is None:
+            return None
+
+        return list(signature) + self.rates.key()
+
+    def save_totals(self):
+        if self.signature == self.store.signature():
+            self.totals.save(self.totals_path, self.totals_signature(self.signature))
+
+    def close(self):
+        self.save_totals()
+        self.update_snapshot()
+
+    def refresh(self):
+        """Apply whatever other processes wrote to the log since we last looked, return True if anything changed.
+
+        An edited rates file is read again and the running totals converted anew.
+        """
+        rates_changed = self.refresh_rates()
+        if not self.store.changed():
+            return rates_changed
+
+        with self.store.lock, metrics.timer("ledger.refresh"):
+            entries = self.store.read_new()
+            if entries is None:
+                self.rebuild()
+            else:
+                self.apply_entries(entries)
+
+            self.signature = self.store.signature()
+            self.refreshes += 1
+
+        return True
+
+    def refresh_rates(self):
+        if not self.rates.changed():
+            return False
+
+        with self.store.lock, metrics.timer("ledger.refresh_rates"):
+            self.rates = self.rates.reload()
+            self.totals = self.compute_totals()
+            self.version += 1
+
+        return True
+
+    def apply_entries(self, entries):
+        adds = [entry for entry in entries if entry["op"] == "add"]
+        # Bisect inserts for a few rows, one sort for a large import
+        index = len(adds) < self.bulk_index_rows
+
+        for entry in entries:
+            if entry["op"] == "add":
+                self.append_row(entry["id"], entry["date"], entry["description"], entry["amount"], entry.get("currency", DEFAULT_CURRENCY), entry.get("deleted", False), index=index, count=True)
+            elif entry["op"] in ("delete", "restore"):
+                row = self.row_of(entry["id"])
+                if row is not None:
+                    self.mark_deleted(row, entry["op"] == "delete")
+
+        if not index:
+            self.rebuild_index()
+
+    def append_row(self, expense_id, date, description, amount, currency, deleted, index=True, count=False):
+        row = len(self.ids)
+        ordinal = date_to_ordinal(date)
+        cents = to_cents(amount)
+
+        if self.ids and expense_id <= self.ids[-1]:
+            raise ValueError("Expense id {} is not greater than {}".format(expense_id, self.ids[-1]))
+
+        self.ids.append(expense_id)
+        self.ordinals.append(ordinal)
+        self.cents.append(cents)
+        self.deleted.append(deleted)
+        self.descriptions.append(description)
+        self.currencies.append(currency)
+
+        if not ordinal or datetime.date.fromordinal(ordinal).isoformat() != date:
+            self.date_text[row] = date
+
+        if count and ordinal and not deleted:
+            self.totals.add(datetime.date.fromordinal(ordinal), self.rates.convert_one(cents, currency, ordinal))
+
+        # New expenses are usually the latest date, which makes this an append
+        if index:
+            position = bisect.bisect_right(self.sorted_ordinals, ordinal)
+            self.sorted_ordinals.insert(position, ordinal)
+            self.sorted_rows.insert(position, row)
+
+        self.version += 1
+
+    def rebuild_index(self):
+        # Timsort is close to linear on the mostly sorted dates of a ledger
+        ordinals = np.array(self.ordinals, dtype=np.int32)
+        rows = np.argsort(ordinals, kind="stable")
+        self.sorted_rows = index_array(rows)
+        self.sorted_ordinals = array.array("i", ordinals[rows].tobytes())
+
+    # Writes hold the store lock from catching up to appending, so the
+    # columns always match the log and no other process slips in between
+
+    def add(self, date, description, amount, currency=BASE_CURRENCY):
+        with self.store.lock:
+            self.refresh()
+            expense_id = self.store.add(date, description, amount, currency)
+            self.append_row(expense_id, date, description, amount, currency, False, count=True)
+            self.signature = self.store.signature()
+
+        return expense_id
+
+    def add_many(self, expenses):
+        with self.store.lock:
+            self.refresh()
+            expense_ids = self.store.add_many(expenses)
+            index = len(expense_ids) < self.bulk_index_rows
+            for expense_id, expense in zip(expense_ids, expenses):
+                date, description, amount, currency = expense_fields(expense)
+                self.append_row(expense_id, date, description, amount, currency, False, index=index, count=True)
+
+            if not index:
+                self.rebuild_index()
+            self.signature = self.store.signature()
+
+        return expense_ids
+
+    def set_deleted(self, expense_id, deleted):
+        return bool(self.set_deleted_many([expense_id], deleted))
+
+    def set_deleted_many(self, expense_ids, deleted, journal=True):
+        """Delete (or restore) expenses with a single log write, return the ids whose flag changed.
+
+        The batch goes into the undo journal unless journal is False.
+        """
+        with self.store.lock:
+            self.refresh()
+
+            rows = {}
+            for expense_id in expense_ids:
+                row = self.row_of(expense_id)
+                if row is not None and self.deleted[row] != deleted:
+                    rows[expense_id] = row
+
+            changed = self.store.set_deleted_many(list(rows), deleted)
+            for expense_id in changed:
+                self.mark_deleted(rows[expense_id], deleted)
+
+            if changed:
+                self.signature = self.store.signature()
+                if journal:
+                    self.journal.record(changed, deleted)
+
+        return changed
+
+    def mark_deleted(self, row, deleted):
+        if self.deleted[row] != deleted and self.ordinals[row]:
+            date = datetime.date.fromordinal(self.ordinals[row])
+            if deleted:
+                self.totals.remove(date, self.base_cents_of(row))
+            else:
+                self.totals.add(date, self.base_cents_of(row))
+
+        self.deleted[row] = deleted
+        self.version += 1
+
+    def delete(self, expense_id):
+        return self.set_deleted(expense_id, True)
+
+    def restore(self, expense_id):
+        return self.set_deleted(expense_id, False)
+
+    def undo(self):
+        """Reverse the newest delete or restore batch, return (changed ids, deleted flag they now have) or None."""
+        batch = self.journal.pop()
+        if batch is None:
+            return None
+
+        expense_ids, deleted = batch
+        return self.set_deleted_many(expense_ids, not deleted, journal=False), not deleted
+
+    def deleted_flags(self):
+        """Return the deleted flags as a bool NumPy array, unpacked once per ledger version."""
+        self.refresh()
+        if self._deleted_flags_version != self.version:
+            self._deleted_flags = self.deleted.to_numpy()
+            self._deleted_flags_version = self.version
+
+        return self._deleted_flags
+
+    def rows(self, deleted=False):
+        """Return an array of the row positions of active (or deleted) expenses."""
+        return index_array(np.flatnonzero(self.deleted_flags() == deleted))
+
+    def rows_between(self, start_date, end_date, deleted=False):
+        """Return an array of the rows dated from start_date to end_date inclusive, in date order."""
+        flags = self.deleted_flags()
+        start = bisect.bisect_left(self.sorted_ordinals, start_date.toordinal())
+        end = bisect.bisect_right(self.sorted_ordinals, end_date.toordinal())
+        # Slicing copies, so the sorted index can still grow while the view is alive
+        rows = np.asarray(self.sorted_rows[start:end], dtype=np.int64)
+        return index_array(rows[flags[rows] == deleted])
+
+    def view(self, start_date=None, end_date=None, deleted=False, period=None):
+        """Return (rows, total in cents) for a date range, or for every date if no range is given.
+
+        With period set to day, week, month or year the total is read from the
+        running totals of the period containing start_date.
+        """
+        if start_date is None and end_date is None:
+            rows = self.rows(deleted)
+        else:
+            rows = self.rows_between(start_date or datetime.date.min, end_date or datetime.date.max, deleted)
+
+        if period and not deleted:
+            return rows, self.totals.total(period, start_date)
+
+        return rows, self.aggregator().total_cents(rows)
+
+    def search(self, text, start_date=None, end_date=None, deleted=False):
+        """Return (rows, total in cents) of expenses whose description matches every word of text as a prefix.
+
+        An empty text is the same as view() over the same range.
+        """
+        rows = self.search_index().search(self, text, start_date, end_date, deleted)
+        if rows is None:
+            return self.view(start_date, end_date, deleted)
+
+        return rows, self.aggregator().total_cents(rows)
+
+    def search_index(self):
+        self.refresh()
+        if self._search_index is None:
+            self._search_index = SearchIndex()
+
+        # Only descriptions first seen since the last search are tokenized
+        self._search_index.update(self.descriptions)
+        return self._search_index
+
+    def aggregator(self):
+        if self._aggregator is None:
+            self._aggregator = Aggregator(self)
+
+        return self._aggregator
+
+    def group_by(self, period, deleted=False):
+        return self.aggregator().group_by(period, deleted=deleted)
+
+    def by_description(self, deleted=False):
+        return self.aggregator().by_description(deleted=deleted)
+
+    def date_of(self, row):
+        date = self.date_text.get(row)
+        if date is None:
+            return datetime.date.fromordinal(self.ordinals[row]).isoformat()
+
+        return date
+
+    def amount_of(self, row):
+        return format_cents(self.cents[row])
+
+    def base_cents_of(self, row):
+        return self.rates.convert_one(self.cents[row], self.currencies[row], self.ordinals[row])
+
+    def row_values(self, row):
+        # The row id is the stable record id so remove and restore don't have to search for it
+        amount = self.amount_of(row)
+        if self.currencies[row] != self.rates.base:
+            amount += " " + self.currencies[row]
+
+        return str(self.ids[row]), (self.date_of(row), self.descriptions[row], amount)
+
+    def record_values(self, row):
+        return self.date_of(row), self.descriptions[row], to_decimal(self.cents[row]), self.currencies[row]
+
+    def ids_of(self, rows):
+        """Return the ids of the given rows as an int64 NumPy array."""
+        return np.array(self.ids, dtype=np.int64)[np.asarray(rows, dtype=np.int64)]
+
+    def row_of(self, expense_id):
+        row = bisect.bisect_left(self.ids, expense_id)
+        if row < len(self.ids) and self.ids[row] == expense_id:
+            return row
+
+        return None
+
+    def amount_cents(self, expense_id):
+        """Return the amount of an expense in base currency cents."""
+        return self.base_cents_of(self.row_of(expense_id))
+
+    def record(self, row):
+        return {
+            "id": self.ids[row],
+            "date": self.date_of(row),
+            "description": self.descriptions[row],
+            "amount": self.amount_of(row),
+            "currency": self.currencies[row],
+            "deleted": self.deleted[row],
+        }
+
+    def memory_usage(self):
+        """Return the bytes held by each column, their total and the total scaled to a million rows."""
+        usage = {
+            "ids": sizeof_array(self.ids),
+            "ordinals": sizeof_array(self.ordinals),
+            "cents": sizeof_array(self.cents),
+            "deleted": self.deleted.nbytes(),
+            "descriptions": self.descriptions.nbytes(),
+            "currencies": self.currencies.nbytes(),
+            "date_text": sizeof_text(self.date_text),
+            "date_index": sizeof_array(self.sorted_ordinals) + sizeof_array(self.sorted_rows),
+        }
+        usage["total"] = sum(usage.values())
+        usage["per_million_rows"] = usage["total"] * 1000000 // len(self.ids) if self.ids else 0
+        return usage
+
+
+def sizeof_text(texts):
+    return sys.getsizeof(texts) + sum(sys.getsizeof(text) for text in texts.values())
+
+
+def date_to_ordinal(date):
+    # Stored dates are ISO strings, anything else only goes through dateparser once here
+    try:
+        return datetime.date.fromisoformat(date).toordinal()
+    except ValueError:
+        import parsing
+
+        parsed = parsing.parse_date_text(date)
+        if parsed is None:
+            return 0
+
+        return parsed.date().toordinal()
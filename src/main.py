@@ -1,18 +1,29 @@
+import time
+
+# Measured from here so the startup metric includes our own imports
+process_start = time.perf_counter()
+
 import sys
 import tkinter as tk
 from tkinter import ttk
-import nltk
 import datetime
-import re
-import dateparser
-import json
-import os
-import threading
-import pandas as pd
 from tkinter import filedialog
+from tkinter import messagebox
+import nlp
+import logging
+from instrumentation import log, metrics, Profiler
+from money import BASE_CURRENCY, format_money
+from totals import period_range
+import parsing
+import importer
+import export
+from tasks import TaskExecutor
+from storage import CorruptLogError, ExpenseStore
+from engine import BACKENDS, ExpenseEngine, open_ledger
+from virtual_table import VirtualTable
 
 class App(tk.Tk):
-    def __init__(self):
+    def __init__(self, backend="log", store_path=None):
         super().__init__()
 
         # Set the ttk theme to use the default theme
@@ -34,34 +45,9 @@ class App(tk.Tk):
             self.style.theme_use("clam")
             self.selected_theme_value.set(self.selected_theme_map.get("clam"))
 
-        # Load the NLTK data in a separate thread
-        self.loading_thread = threading.Thread(target=self.load_nltk_data)
-        self.loading_thread.start()
-
         self.title("Python Expenses Tracker")
         self.geometry("1600x900")
 
-        self.loading_label = ttk.Label(self, text="Loading NLTK data: ")
-        self.loading_value = 0.0
-        self.loading_start = datetime.datetime.now()
-
-        self.loader_spinner = ttk.Progressbar(self, mode="indeterminate")
-
-        # Wait for the thread to finish
-        while self.loading_thread.is_alive():
-            self.loading_value = (datetime.datetime.now() - self.loading_start).total_seconds()
-            self.loader_spinner.pack(pady=10, padx=100, fill=tk.X, expand=True)
-            self.loading_label.pack(pady=10, padx=10)
-            self.loading_label.config(text="Loading NLTK data: {:.2f} seconds".format(self.loading_value))
-            self.loader_spinner.step(0.1)
-            self.update()
-
-        self.loading_label.destroy()
-        self.loader_spinner.destroy()
-        self.total_loading_time = (datetime.datetime.now() - self.loading_start).total_seconds()
-
-        print("NLTK data loaded in {:.2f} seconds".format(self.total_loading_time))
-        
         # Create a menu bar
         self.menu_bar = tk.Menu(self)
         self.config(menu=self.menu_bar)
@@ -73,12 +59,40 @@ class App(tk.Tk):
         # Add "Exit" option to the "File" menu
         self.file_menu.add_command(label="Exit", command=self.quit)
 
+        # Add an "Import messages" option to the "File" menu
+        self.file_menu.add_command(label="Import messages...", command=lambda: self.import_messages())
+
         # Add a "Export to Excel" option to the "File" menu
         self.file_menu.add_command(label="Export to Excel", command=lambda: self.export_to_excel())
 
         # Add a "Export to CSV" option to the "File" menu
         self.file_menu.add_command(label="Export to CSV", command=lambda: self.export_to_csv())
 
+        # Add "Export to Parquet" and "Export to JSON Lines" options to the "File" menu
+        self.file_menu.add_command(label="Export to Parquet", command=lambda: self.export_to_parquet())
+        self.file_menu.add_command(label="Export to JSON Lines", command=lambda: self.export_to_jsonl())
+
+        # Add an "Edit" menu with undo and bulk changes to every expense in the view
+        self.edit_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="Edit", menu=self.edit_menu)
+        self.edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=lambda: self.undo())
+        self.edit_menu.add_command(label="Remove all in view", command=lambda: self.change_all_in_view())
+        self.bind("<Control-z>", lambda e: self.undo())
+
+        # Add a "Breakdown" menu with totals grouped by period or description
+        self.breakdown_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="Breakdown", menu=self.breakdown_menu)
+
+        for period in ("day", "week", "month", "year"):
+            self.breakdown_menu.add_command(label="By " + period, command=lambda period=period: self.display_breakdown(period))
+
+        self.breakdown_menu.add_command(label="By description", command=lambda: self.display_breakdown("description"))
+
+        # Add a "Debug" menu with the timing and counter panel
+        self.debug_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="Debug", menu=self.debug_menu)
+        self.debug_menu.add_command(label="Metrics...", command=lambda: self.show_metrics())
+
         # Add a "Themes" menu
         self.themes_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label="Theme", menu=self.themes_menu)
@@ -96,16 +110,18 @@ class App(tk.Tk):
         self.table.heading("Amount", text="Amount")
         self.table.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
 
-        self.scrollbar = ttk.Scrollbar(self.table, orient="vertical", command=self.table.yview)
+        self.scrollbar = ttk.Scrollbar(self.table, orient="vertical")
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-        self.table.configure(yscrollcommand=self.scrollbar.set)
+        # Only the visible rows live in the Treeview, the scrollbar moves the window
+        self.virtual_table = VirtualTable(self.table, self.scrollbar)
 
         self.top_frame = tk.Frame(self)
         self.top_frame.pack(pady=10, padx=10, fill=tk.X)
 
-        self.total_expense_value = 0.0
-        self.total_label = ttk.Label(self.top_frame, text="Total expenses: ${:.2f}".format(self.total_expense_value))
+        # Kept in integer cents so adding and removing rows never drifts
+        self.total_expense_cents = 0
+        self.total_label = ttk.Label(self.top_frame, text="Total expenses: {}".format(format_money(self.total_expense_cents)))
         self.total_label.pack(pady=10, padx=10, fill=tk.X, side=tk.RIGHT, expand=True)
 
         self.middle_frame = tk.Frame(self)
@@ -136,17 +152,35 @@ class App(tk.Tk):
         self.to_date_entry = ttk.Entry(self.middle_frame, width=10)
         self.to_date_entry.pack(pady=10, padx=10, side=tk.LEFT)
         
-        self.date_range_button = ttk.Button(self.middle_frame, text="Date range", command=lambda: self.display_date_range_expenses(dateparser.parse(self.from_date_entry.get()), dateparser.parse(self.to_date_entry.get())))
+        self.date_range_button = ttk.Button(self.middle_frame, text="Date range", command=self.display_date_range_from_entries)
         self.date_range_button.pack(pady=10, padx=10, side=tk.LEFT)
 
+        # Searches descriptions as you type, within the From/To range if one is filled in
+        self.search_label = ttk.Label(self.middle_frame, text="Search:")
+        self.search_label.pack(pady=10, padx=10, side=tk.LEFT)
+        self.search_entry = ttk.Entry(self.middle_frame, width=30)
+        self.search_entry.bind("<KeyRelease>", lambda e: self.schedule_search())
+        self.search_entry.bind("<Return>", lambda e: self.search_expenses())
+        self.search_entry.pack(pady=10, padx=10, side=tk.LEFT)
+        self.search_after_id = None
+
         self.remove_button = ttk.Button(self.middle_frame, text="Remove", command=self.remove_selected_expenses)
         self.remove_button.pack(pady=10, padx=10, side=tk.RIGHT)
 
         self.display_deleted_button = ttk.Button(self.middle_frame, text="Deleted", command=self.display_deleted_expenses)
         self.display_deleted_button.pack(pady=10, padx=10, side=tk.RIGHT)
 
-        for expense in self.load_json_data():
-            self.add_expense(expense["date"], expense["description"], expense["amount"])
+        # Parsing and storage live in the engine, every view queries its ledger,
+        # an in-memory copy of the log or a SQLite database
+        self.engine = ExpenseEngine(backend, store_path)
+        self.ledger = self.engine.ledger
+
+        # Most messages are simple enough for a regex, fast_parser.hit_rate() tracks how many
+        self.fast_parser = self.engine.parser
+
+        # Disk, pandas and NLTK work runs here, results come back on the Tk thread
+        self.tasks = TaskExecutor(self)
+        self.protocol("WM_DELETE_WINDOW", self.quit)
 
         self.bottom_frame = tk.Frame(self)
         self.bottom_frame.pack(pady=10, padx=10, fill=tk.X)
@@ -161,408 +195,440 @@ class App(tk.Tk):
 
         self.display_all_expenses()
 
+        # Other instances and cron imports write to the same store, reload the view when they do
+        self.watch_interval = 1000
+        self.seen_refreshes = 0
+        self.after(self.watch_interval, self.watch_for_changes)
+
+        # The next start copies the columns from the snapshot instead of replaying the whole log
+        self.tasks.submit(self.ledger.update_snapshot)
+
+        # NLTK, dateparser and pandas are only imported once a feature needs them
+        self.update_idletasks()
+        self.startup_time = time.perf_counter() - process_start
+        metrics.record("startup", self.startup_time)
+        log.info("Started in %.2f seconds", self.startup_time)
+
     def quit(self):
+        # Let queued writes finish before leaving
+        self.tasks.shutdown()
+        self.engine.close()
         super().quit()
 
+    def watch_for_changes(self):
+        # A stat of the log (or PRAGMA data_version) every second, only the delta is read
+        def checked(changed):
+            # View queries refresh the ledger too, so compare the counter rather than this result
+            if self.ledger.refreshes != self.seen_refreshes:
+                self.seen_refreshes = self.ledger.refreshes
+                self.reload_view()
+
+        if self.tasks.closed:
+            return
+
+        self.tasks.submit(self.ledger.refresh, on_done=checked)
+        self.after(self.watch_interval, self.watch_for_changes)
+
     def save_file_as(self, extension, file_types):
         return filedialog.asksaveasfilename(defaultextension=extension, filetypes=file_types)
 
-    def export_to_excel(self):
-        row_list = []
-        columns = ('Date', 'Description', 'Amount')
-        for row in self.table.get_children():
-            row_list.append(self.table.item(row)["values"])
+    def import_messages(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Text or CSV", "*.txt *.csv"), ("All files", "*.*")])
+        if not file_path:
+            return
+
+        def progress(done, total):
+            self.tasks.call_soon(lambda: self.title_label.config(text="Importing: {} of {} messages".format(done, total)))
+
+        def finished(report):
+            message = "Imported {} expenses, {:.0%} of them through the fast parser.".format(report.imported, report.fast_path_hit_rate())
 
-        treeview_df = pd.DataFrame(row_list, columns = columns)
-        treeview_df.to_excel(self.save_file_as("xlsx", [("Excel", "*.xlsx")]), index=False)
+            if report.errors:
+                report_path = file_path + ".errors.tsv"
+                report.write(report_path)
+                message += "\n{} lines could not be parsed, see {}".format(len(report.errors), report_path)
+
+            self.display_all_expenses()
+            messagebox.showinfo("Import", message)
+
+        self.tasks.submit(lambda: importer.import_messages(file_path, self.ledger, progress=progress), on_done=finished, on_error=self.show_error)
+
+    def export_to_excel(self):
+        self.export_table(self.save_file_as("xlsx", [("Excel", "*.xlsx")]))
 
     def export_to_csv(self):
-        row_list = []
-        columns = ('Date', 'Description', 'Amount')
-        for row in self.table.get_children():
-            row_list.append(self.table.item(row)["values"])
+        self.export_table(self.save_file_as("csv", [("CSV", "*.csv")]))
+
+    def export_to_parquet(self):
+        self.export_table(self.save_file_as("parquet", [("Parquet", "*.parquet")]))
+
+    def export_to_jsonl(self):
+        self.export_table(self.save_file_as("jsonl", [("JSON Lines", "*.jsonl")]))
+
+    def export_table(self, file_path):
+        if not file_path:
+            return
+
+        # Export the current view straight from the ledger, not from the Treeview items
+        rows = list(self.virtual_table.rows)
+        if self.virtual_table.row_values == self.ledger.row_values:
+            records = export.ledger_records(self.ledger, rows)
+            columns = export.LEDGER_COLUMNS
+        else:
+            row_values = self.virtual_table.row_values
+            records = (row_values(row)[1] for row in rows)
+            columns = export.COLUMNS
+
+        self.tasks.submit(export.export_records, records, file_path, None, columns, lane="work", on_error=self.show_error)
+
+    def show_error(self, error):
+        messagebox.showerror("Error", str(error))
+
+    def show_metrics(self):
+        """Open a window with timer percentiles, counters and cache statistics."""
+        window = tk.Toplevel(self)
+        window.title("Metrics")
+
+        text = tk.Text(window, width=90, height=40, font="TkFixedFont")
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+
+        def refresh():
+            lines = [metrics.report(), ""]
+            lines.append("fast path hit rate: {:.1%}".format(self.fast_parser.hit_rate()))
+            for name, stats in parsing.cache_stats().items():
+                lines.append("{} cache: {}".format(name, stats))
+
+            text.delete("1.0", tk.END)
+            text.insert(tk.END, "\n".join(lines))
 
-        treeview_df = pd.DataFrame(row_list, columns = columns)
-        treeview_df.to_csv(self.save_file_as("csv", [("CSV", "*.csv")]), index=False)
+        def reset():
+            metrics.reset()
+            refresh()
+
+        ttk.Button(window, text="Refresh", command=refresh).pack(side=tk.LEFT, padx=10, pady=10)
+        ttk.Button(window, text="Reset", command=reset).pack(side=tk.LEFT, padx=10, pady=10)
+        refresh()
 
     def change_theme(self, theme_name):
         """Change the ttk theme."""
         self.style.theme_use(theme_name)
         self.selected_theme_value.set(self.selected_theme_map.get(theme_name))
 
-    def clear_data_from_table(self):
-        for item in self.table.get_children():
-            self.table.delete(item)
-
     def display_daily_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Daily expenses")
-        self.displaying_deleted = False
-
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            if expense["date"] == datetime.date.today().strftime('%Y-%m-%d'):
-                self.add_expense(expense["date"], expense["description"], expense["amount"])
-                total_expense += float(expense["amount"])
+        self.display_current_period("Daily expenses", "day")
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+    def display_date_range_from_entries(self):
+        self.display_date_range_expenses(parsing.parse_date_text(self.from_date_entry.get()), parsing.parse_date_text(self.to_date_entry.get()))
 
     def display_date_range_expenses(self, start_date, end_date):
-        self.clear_data_from_table()
-        self.title_label.config(text="Date range expenses")
-        self.displaying_deleted = False
-
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            date = dateparser.parse(expense["date"])
-            if date >= start_date and date <= end_date:
-                self.add_expense(expense["date"], expense["description"], expense["amount"])
-                total_expense += float(expense["amount"])
-
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+        # An empty or unparsable From/To leaves that side of the range open
+        start_date = start_date.date() if start_date else datetime.date.min
+        end_date = end_date.date() if end_date else datetime.date.max
+        self.display_period_expenses("Date range expenses", start_date, end_date)
 
     def display_weekly_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Weekly expenses")
-        self.displaying_deleted = False
+        self.display_current_period("Weekly expenses", "week")
 
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            date = dateparser.parse(expense["date"])
-            if date.isocalendar()[1] == datetime.date.today().isocalendar()[1]:
-                self.add_expense(expense["date"], expense["description"], expense["amount"])
-                total_expense += float(expense["amount"])
+    def display_monthly_expenses(self):
+        self.display_current_period("Monthly expenses", "month")
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+    def display_yearly_expenses(self):
+        self.display_current_period("Yearly expenses", "year")
 
-    def display_monthly_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Monthly expenses")
-        self.displaying_deleted = False
+    def display_current_period(self, title, period):
+        start_date, end_date = period_range(period, datetime.date.today())
+        self.display_period_expenses(title, start_date, end_date, period)
 
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            date = dateparser.parse(expense["date"])
-            if date.month == datetime.date.today().month:
-                self.add_expense(expense["date"], expense["description"], expense["amount"])
-                total_expense += float(expense["amount"])
+    def display_period_expenses(self, title, start_date, end_date, period=None):
+        # Whole days, weeks, months and years read their total from the running totals
+        self.load_view(title, lambda: self.ledger.view(start_date, end_date, period=period))
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+    def display_all_expenses(self):
+        self.load_view("Total expenses", lambda: self.ledger.view())
 
-    def display_yearly_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Yearly expenses")
-        self.displaying_deleted = False
+    def display_deleted_expenses(self):
+        self.load_view("Deleted expenses", lambda: self.ledger.view(deleted=True), deleted=True)
+
+    def load_view(self, title, query, deleted=False):
+        # Runs on the io thread, clicking another view before this one is done cancels it
+        self.reload_view = lambda: self.load_view(title, query, deleted)
+        def run():
+            with metrics.timer("view.query"):
+                return query()
+
+        def show(result):
+            rows, total = result
+            with metrics.timer("view.render"):
+                self.title_label.config(text=title)
+                self.displaying_deleted = deleted
+
+                self.virtual_table.set_rows(rows, self.ledger.row_values, self.ledger.ids_of)
+                self.update_total_expense(total)
+                self.update_delete_button()
+
+        self.tasks.submit(run, on_done=show, key="view")
+
+    def schedule_search(self):
+        # Wait for a short pause in typing instead of querying on every key
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+
+        self.search_after_id = self.after(150, self.search_expenses)
+
+    def search_expenses(self):
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+            self.search_after_id = None
+
+        text = self.search_entry.get().strip()
+        if not text:
+            self.display_all_expenses()
+            return
 
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            date = dateparser.parse(expense["date"])
-            if date.year == datetime.date.today().year:
-                self.add_expense(expense["date"], expense["description"], expense["amount"])
-                total_expense += float(expense["amount"])
+        from_text = self.from_date_entry.get()
+        to_text = self.to_date_entry.get()
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+        def query():
+            # An empty or unparsable From/To leaves that side of the range open
+            start_date = parsing.parse_date_text(from_text) if from_text.strip() else None
+            end_date = parsing.parse_date_text(to_text) if to_text.strip() else None
+            return self.ledger.search(text, start_date and start_date.date(), end_date and end_date.date())
 
-    def display_all_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Total expenses")
-        self.displaying_deleted = False
+        self.load_view("Search: " + text, query)
 
-        total_expense = 0.0
-        for expense in self.load_json_data():
-            self.add_expense(expense["date"], expense["description"], expense["amount"])
-            total_expense += float(expense["amount"])
+    def display_breakdown(self, period):
+        self.reload_view = lambda: self.display_breakdown(period)
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+        def compute():
+            if period == "description":
+                groups = self.ledger.by_description()
+                labels = groups["description"]
+            else:
+                groups = self.ledger.group_by(period)
+                labels = groups["period"]
 
-    def display_deleted_expenses(self):
-        self.clear_data_from_table()
-        self.title_label.config(text="Deleted expenses")
-        self.displaying_deleted = True
+            values = [(label, "{} expenses".format(count), "{:.2f}".format(total)) for label, count, total in zip(labels, groups["count"], groups["total"])]
+            return values, round(float(groups["total"].sum()) * 100)
 
-        print("Deleted expenses")
+        def show(result):
+            values, total = result
+            self.title_label.config(text="Expenses by " + period)
+            self.displaying_deleted = False
 
-        total_expense = 0.0
-        for expense in self.load_deleted_json_data():
-            #if expense["deleted"] == True:
-            self.add_expense(expense["date"], expense["description"], expense["amount"])
-            total_expense += float(expense["amount"])
+            self.virtual_table.set_rows(list(range(len(values))), lambda index: ("group-{}".format(index), values[index]))
+            self.update_total_expense(total)
 
-        self.update_total_expense(total_expense)
-        self.update_delete_button()
+            # Grouped rows aren't single expenses, so they can't be removed
+            self.remove_button.config(state=tk.DISABLED)
+            self.edit_menu.entryconfig(1, state=tk.DISABLED)
+
+        self.tasks.submit(compute, on_done=show, key="view")
 
     def update_delete_button(self):
+        self.remove_button.config(state=tk.NORMAL)
+        self.edit_menu.entryconfig(1, state=tk.NORMAL)
         if self.displaying_deleted:
             self.remove_button.config(text="Restore selected", command=self.restore_selected_expenses)
+            self.edit_menu.entryconfig(1, label="Restore all in view")
         else:
             self.remove_button.config(text="Remove selected", command=self.remove_selected_expenses)
-
-    def load_nltk_data(self):
-        # Download the NLTK data
-        nltk.download("all")
-        self.language_model = nltk.data.load("tokenizers/punkt/english.pickle")
+            self.edit_menu.entryconfig(1, label="Remove all in view")
 
     def send_message(self):
         message = self.message_entry.get()
-        if message:
-            date, description, amount = self.interpret_message(message)
-            self.add_expense(date, description, amount)
-            self.save_to_json(date, description, amount)
+        if not message:
+            return
 
-            self.message_entry.delete(0, tk.END)
+        def parsed(result):
+            date, description, amount, currency = result
 
-    def update_total_expense(self, amount):
-        self.total_expense_value = float(amount)
-        self.total_label.config(text="Total expenses: ${:.2f}".format(self.total_expense_value))
+            def save():
+                expense_id = self.save_to_json(date, description, amount, currency)
+                # The total is in the base currency, converted at the rate of the expense's date
+                return expense_id, self.ledger.amount_cents(expense_id)
 
-    def add_expense(self, date, description, amount):
-        self.table.insert("", tk.END, values=(date, description, amount))
-        self.update_total_expense(self.total_expense_value + float(amount))
+            self.tasks.submit(save, on_done=lambda saved_expense: saved(*saved_expense, date, description, amount))
 
-    def remove_selected_expenses(self):
-        for selected_item in self.table.selection():
-            date = self.table.item(selected_item)["values"][0]
-            description = self.table.item(selected_item)["values"][1]
-            amount = self.table.item(selected_item)["values"][2]
+        def saved(expense_id, cents, date, description, amount):
+            self.add_expense(date, description, amount, expense_id)
+            self.update_total_expense(self.total_expense_cents + cents)
+
+            # Only clear the entry if the user hasn't started typing the next one
+            if self.message_entry.get() == message:
+                self.message_entry.delete(0, tk.END)
+
+        def failed(error):
+            if isinstance(error, nlp.MissingNLTKData):
+                messagebox.showerror("Offline", str(error))
+            else:
+                self.show_error(error)
+
+        self.tasks.submit(self.interpret_message, message, lane="work", on_done=parsed, on_error=failed)
 
-            self.remove_from_json(date, description, amount)
-            self.table.delete(selected_item)
-            self.update_total_expense(self.total_expense_value - float(amount))
+    def update_total_expense(self, cents):
+        self.total_expense_cents = int(cents)
+        self.total_label.config(text="Total expenses: {}".format(format_money(self.total_expense_cents)))
+
+    def add_expense(self, date, description, amount, expense_id):
+        # Grouped breakdown views don't show single expenses
+        if self.virtual_table.row_values == self.ledger.row_values:
+            self.virtual_table.append(self.ledger.row_of(expense_id))
+
+    def remove_selected_expenses(self):
+        self.change_selected_expenses(True)
 
     def restore_selected_expenses(self):
-        for selected_item in self.table.selection():
-            date = self.table.item(selected_item)["values"][0]
-            description = self.table.item(selected_item)["values"][1]
-            amount = self.table.item(selected_item)["values"][2]
-
-            self.restore_deleted_from_json(date, description, amount)
-            self.table.delete(selected_item)
-            self.update_total_expense(self.total_expense_value - float(amount))
-
-    def restore_deleted_from_json(self, date, description, amount):
-        file_path = "expenses.json"
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-        else:
-            print("No data to restore")
+        self.change_selected_expenses(False)
+
+    def change_selected_expenses(self, deleted):
+        # The whole selection is one log write (or transaction) and one undo step
+        selection = self.virtual_table.selection()
+        expense_ids = [int(selected_item) for selected_item in selection]
+
+        def apply():
+            changed = self.ledger.set_deleted_many(expense_ids, deleted)
+            return sum(self.ledger.amount_cents(expense_id) for expense_id in changed)
+
+        def applied(cents_removed):
+            self.virtual_table.remove(selection)
+            self.update_total_expense(self.total_expense_cents - cents_removed)
+
+        self.tasks.submit(apply, on_done=applied)
+
+    def change_all_in_view(self):
+        rows = self.virtual_table.rows
+        if not len(rows) or self.virtual_table.row_values != self.ledger.row_values:
             return
-        
-        for index, expense in enumerate(data):
-            if expense["date"] == str(date) and expense["description"] == str(description) and expense["amount"] == str(amount):
-                data[index]["deleted"] = False
-                break
-
-        with open(file_path, 'w') as file:
-            json.dump(data, file, indent=4)
-
-    def remove_from_json(self, date, description, amount):
-        file_path = "expenses.json"
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-        else:
-            print("No data to remove")
+
+        deleted = not self.displaying_deleted
+        verb = "Remove" if deleted else "Restore"
+        if not messagebox.askyesno(verb + " all in view", "{} all {} expenses in this view?".format(verb, len(rows))):
             return
-        
-        for index, expense in enumerate(data):
-            if expense["date"] == str(date) and expense["description"] == str(description) and expense["amount"] == str(amount):
-                data[index]["deleted"] = True
-                break
 
-        with open(file_path, 'w') as file:
-            json.dump(data, file, indent=4)
+        # Ids are taken for the whole view at once, before the rows can change
+        expense_ids = self.virtual_table.row_ids(rows).tolist()
 
-    def parse_date(self, tokens):
-        parsed_value = None
-        parsed_date = None
+        def apply():
+            return self.ledger.set_deleted_many(expense_ids, deleted)
 
-        new_tokens = []
-        for token in tokens:
-            if token == "last" or token == "next" or token == "this":
-                token = token + " " + tokens[tokens.index(token) + 1]
-            
-            new_tokens.append(token)
+        self.tasks.submit(apply, on_done=lambda changed: self.reload_view())
 
-        for token in new_tokens:
-            parsed_value = token
+    def undo(self):
+        def undone(result):
+            if result is None:
+                log.info("Nothing to undo")
+                return
 
-            if token == "last night":
-                token = "yesterday"
+            self.reload_view()
 
-            date = dateparser.parse(token)
+        self.tasks.submit(self.ledger.undo, on_done=undone)
 
-            print(token, date)
-            
-            if token.isdigit() and len(token) < 4:
-                continue
+    def interpret_message(self, message):
+        return self.engine.interpret_message(message)
 
-            if token.isdigit() and (int(token) < 1900 or int(token) > 2100):
-                continue
+    def save_to_json(self, date, description, amount, currency=BASE_CURRENCY):
+        return self.engine.add(date, description, amount, currency)
 
-            #if token.contains("paid") or token.contains("spent") or token.contains("sent"):
-            #    continue
+def import_command(args):
+    ledger = open_ledger(args.backend, args.store)
 
-            if date:
-                if token == "I" or token == "spent" or token == "paid" or token == "sent" or token == "bar":
-                    continue
+    def progress(done, total):
+        print("\r{} of {} messages".format(done, total), end="", file=sys.stderr, flush=True)
 
-                parsed_date = date.strftime('%Y-%m-%d')
-                break
+    report = importer.import_messages(args.file, ledger, workers=args.workers, chunk_size=args.chunk_size, progress=progress)
+    print(file=sys.stderr)
 
-            print(parsed_value, date)
+    for line_number, message, error in report.errors:
+        print("line {}: {}: {}".format(line_number, error, message), file=sys.stderr)
 
-        print(parsed_date, parsed_value)
+    ledger.close()
+    print("Imported {} expenses, {} errors, fast path hit rate {:.0%}".format(report.imported, len(report.errors), report.fast_path_hit_rate()))
+    return 1 if report.errors else 0
 
-        if parsed_date:
-            print(parsed_date, parsed_value)
-            return parsed_date, parsed_value
+def export_command(args):
+    ledger = open_ledger(args.backend, args.store)
+    count = export.export_records(export.ledger_records(ledger, ledger.view(deleted=args.deleted)[0]), args.file, args.format, export.LEDGER_COLUMNS)
 
-        print(None, None)
-        return None, None
+    print("Exported {} expenses".format(count))
+    return 0
 
-    def interpret_message(self, message):
-        tokens = nltk.word_tokenize(message)
-        tagged = nltk.pos_tag(tokens)
-        entities = nltk.ne_chunk(tagged)
-
-        date_value, parsed_date_value = self.parse_date(tokens)
-        description = []
-        amount = None
-
-        for subtree in entities:
-            if isinstance(subtree, nltk.Tree):
-                if subtree.label() == 'DATE':
-                    date_value = " ".join([token for token, pos in subtree.leaves()])
-                elif subtree.label() == 'MONEY':
-                    amount = " ".join([token for token, pos in subtree.leaves()])
-            else:
-                description.append(subtree[0])
-
-        description = " ".join(description)
-
-        # Use today's date if no date is found
-        if not date_value:
-            date_value = datetime.date.today().strftime('%Y-%m-%d')
-
-        # Try to extract amount if not found by NLTK
-        if not amount:
-            amount_match = re.search(r'\d+(\.\d{2})?', message)
-            if amount_match:
-                amount = amount_match.group()
-
-        # If no amount is found, set a default value
-        if not amount:
-            amount = "0.00"
-
-        # Heuristic to improve description extraction
-        if date_value and date_value in description:
-            description = description.replace(date_value, "").strip()
-
-        if amount and amount in description:
-            description = description.replace(amount, "").strip()
-            
-        if parsed_date_value and parsed_date_value in description:
-            description = description.replace(parsed_date_value, "").strip()
-
-        no_no_pharses = [
-            "I spent",
-            "I paid",
-            "I sent",
-            "I paid for",
-            "I spent for",
-            "I sent for",
-            "I paid $",
-            "I spent $",
-            "I sent $",
-            "I paid for $",
-            "I spent on",
-            "I sent on",
-            "I paid on",
-            "$",
-            "for $",
-            "dollars",
-            "dollar",
-            "paid",
-            "spent",
-            "sent",
-        ]
-
-        for phrase in no_no_pharses:
-            description = description.replace(phrase.casefold(), "").strip()
-
-        no_no_pharses_at_end_or_start = [
-            "on",
-            "for",
-            "to",
-            "I",
-        ]
-
-        for phrase in no_no_pharses_at_end_or_start:
-            if description.startswith(phrase):
-                description = description[len(phrase):].strip()
-            if description.endswith(phrase):
-                description = description[:-len(phrase)].strip()
-
-        return date_value, description, amount
-
-    def load_json_data(self):
-        file_path = "expenses.json"
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as file:
-                json.dump([], file)
-
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-
-        new_data = []
-        for entry in data:
-            if entry["deleted"] == False:
-                new_data.append(entry)
-        
-        return new_data
-    
-    def load_deleted_json_data(self):
-        file_path = "expenses.json"
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as file:
-                json.dump([], file)
-
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-
-        new_data = []
-        for entry in data:
-            if entry["deleted"] == True:
-                new_data.append(entry)
-
-        return new_data
-
-    def save_to_json(self, date, description, amount):
-        file_path = "expenses.json"
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-        else:
-            data = []
+def serve_command(args):
+    import server
+
+    server.serve(ExpenseEngine(args.backend, args.store), args.host, args.port, args.workers)
+    return 0
 
-            with open(file_path, 'w') as file:
-                json.dump([], file)
+def migrate_command(args):
+    from sqlite_store import SQLiteLedger
 
-        data.append({"date": date, "description": description, "amount": amount, "deleted": False})
+    database = SQLiteLedger(args.store or BACKENDS["sqlite"])
+    if args.source.endswith(".json"):
+        count = database.migrate_from_json(args.source)
+    else:
+        count = database.migrate_from_store(ExpenseStore(args.source))
 
-        with open(file_path, 'w') as file:
-            json.dump(data, file, indent=4)
+    database.close()
+    print("Migrated {} expenses into {}".format(count, database.file_path))
+    return 0
 
 def main():
-    app = App()
-    app.mainloop()
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Python Expenses Tracker")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=os.environ.get("EXPENSES_BACKEND", "log"), help="storage backend, defaults to $EXPENSES_BACKEND or log")
+    parser.add_argument("--store", default=None, help="storage file, defaults to expenses.log or expenses.db")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--metrics", action="store_true", help="print timer percentiles and counters on exit")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="write a cProfile capture to FILE")
+    parser.add_argument("--tracemalloc", action="store_true", help="report the largest memory allocations on exit")
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser("import", help="import a text or CSV file of expense messages without opening the window")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--workers", type=int, default=None)
+    import_parser.add_argument("--chunk-size", type=int, default=1000)
+
+    export_parser = subparsers.add_parser("export", help="export the ledger without opening the window")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--format", choices=sorted(export.FORMATS.values()), default=None, help="defaults to the file extension")
+    export_parser.add_argument("--deleted", action="store_true", help="export deleted expenses instead")
+
+    migrate_parser = subparsers.add_parser("migrate", help="copy expenses.json or an expenses.log into an empty SQLite database given by --store")
+    migrate_parser.add_argument("--source", default="expenses.json")
+
+    serve_parser = subparsers.add_parser("serve", help="run the HTTP/JSON API without opening the window")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--workers", type=int, default=None, help="parse worker processes, defaults to the CPU count")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    commands = {
+        "import": import_command,
+        "export": export_command,
+        "migrate": migrate_command,
+        "serve": serve_command,
+    }
+
+    with Profiler(args.profile, args.tracemalloc):
+        try:
+            if args.command in commands:
+                status = commands[args.command](args)
+            else:
+                app = App(args.backend, args.store)
+                app.mainloop()
+                status = 0
+        except CorruptLogError as error:
+            print(error, file=sys.stderr)
+            status = 1
+
+    if args.metrics:
+        print(metrics.report(), file=sys.stderr)
+
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
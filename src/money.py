@@ -0,0 +1,129 @@
+import decimal
+import os
+import re
+
+# Currency of records saved before amounts had one
+DEFAULT_CURRENCY = "USD"
+
+# Totals are converted into this currency, messages without a currency are in it too
+BASE_CURRENCY = os.environ.get("EXPENSES_CURRENCY", DEFAULT_CURRENCY).upper()
+
+CURRENCY_SYMBOLS = {
+    "$": "USD",
+    "€": "EUR",
+    "£": "GBP",
+    "¥": "JPY",
+    "₹": "INR",
+}
+
+CURRENCY_WORDS = {
+    "dollar": "USD",
+    "dollars": "USD",
+    "bucks": "USD",
+    "euro": "EUR",
+    "euros": "EUR",
+    "pound": "GBP",
+    "pounds": "GBP",
+    "quid": "GBP",
+    "yen": "JPY",
+    "rupee": "INR",
+    "rupees": "INR",
+}
+
+CURRENCY_CODES = ("USD", "EUR", "GBP", "JPY", "INR", "CHF", "CAD", "AUD", "NZD", "SEK", "NOK", "DKK", "PLN", "CZK", "HUF", "MXN", "BRL", "CNY")
+
+_symbols = "".join(re.escape(symbol) for symbol in CURRENCY_SYMBOLS)
+_codes = "|".join(CURRENCY_CODES)
+_words = "|".join(sorted(CURRENCY_WORDS, key=len, reverse=True))
+
+# "1,250.00", "1.250,00", "12,50" and "12.50", with a currency symbol or code before it, or a symbol, code or word after it
+AMOUNT_PATTERN = re.compile(
+    r"(?<![\w.,-])(?:(?P<symbol>[" + _symbols + r"])\s?|(?P<prefix>" + _codes + r")\s)?"
+    r"(?P<amount>\d{1,3}(?:[,.]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?![\w-]|[.,]\d)"
+    r"(?:\s?(?P<suffix>[" + _symbols + r"]|(?:" + _words + "|" + _codes + r")\b))?",
+    re.IGNORECASE,
+)
+CURRENCY_PATTERN = re.compile(r"[" + _symbols + r"]|\b(?:" + _words + "|" + _codes + r")\b", re.IGNORECASE)
+
+
+def to_cents(amount):
+    """Convert a stored amount ("12.50", 12.5, "3") to integer cents, 0 if it isn't a number."""
+    try:
+        value = decimal.Decimal(str(amount).strip())
+    except decimal.InvalidOperation:
+        return 0
+
+    if not value.is_finite():
+        return 0
+
+    return int((value * 100).quantize(decimal.Decimal(1), rounding=decimal.ROUND_HALF_UP))
+
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    return "{}{}.{:02d}".format(sign, abs(cents) // 100, abs(cents) % 100)
+
+
+def to_decimal(cents):
+    """Return cents as an exact Decimal amount, 1250 becomes Decimal("12.50")."""
+    return decimal.Decimal(cents).scaleb(-2)
+
+
+def format_money(cents, currency=BASE_CURRENCY):
+    """Format cents for display, "$12.50" for currencies with a symbol and "12.50 CHF" for the rest."""
+    for symbol, code in CURRENCY_SYMBOLS.items():
+        if code == currency:
+            return symbol + format_cents(cents)
+
+    return format_cents(cents) + " " + currency
+
+
+def normalize_amount(text):
+    """Turn "1,250.00", "1.250,00" or "12,50" into a plain "1250.00" or "12.50"."""
+    if "," in text and "." in text:
+        # Whichever comes last is the decimal separator
+        thousands = "," if text.rfind(".") > text.rfind(",") else "."
+        return text.replace(thousands, "").replace(",", ".")
+
+    if "," in text:
+        whole, _, fraction = text.rpartition(",")
+        if text.count(",") == 1 and len(fraction) <= 2:
+            return whole + "." + fraction
+        return text.replace(",", "")
+
+    if text.count(".") > 1:
+        return text.replace(".", "")
+
+    return text
+
+
+def currency_code(text):
+    """Return the ISO code for a currency symbol, word or code, None if it isn't one."""
+    if text in CURRENCY_SYMBOLS:
+        return CURRENCY_SYMBOLS[text]
+
+    text = text.lower()
+    if text in CURRENCY_WORDS:
+        return CURRENCY_WORDS[text]
+
+    if text.upper() in CURRENCY_CODES:
+        return text.upper()
+
+    return None
+
+
+def match_currency(match):
+    """Return the currency an AMOUNT_PATTERN match was written with, None if it has none."""
+    marker = match.group("symbol") or match.group("prefix") or match.group("suffix")
+    return currency_code(marker) if marker else None
+
+
+def find_amount(text):
+    """Return the AMOUNT_PATTERN match of the first amount in text, None if there is none."""
+    return AMOUNT_PATTERN.search(text)
+
+
+def find_currency(text):
+    """Return the first currency mentioned anywhere in text, None if there is none."""
+    match = CURRENCY_PATTERN.search(text)
+    return currency_code(match.group()) if match else None
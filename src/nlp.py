@@ -0,0 +1,78 @@
+import os
+
+# Resources used by interpret_message as (download name, data path). NLTK
+# 3.8.2 moved the tokenizer and tagger to new resources and 3.9 the chunker,
+# a release only loads its own names
+LEGACY_RESOURCES = {
+    "tokenizer": ("punkt", "tokenizers/punkt"),
+    "tagger": ("averaged_perceptron_tagger", "taggers/averaged_perceptron_tagger"),
+    "chunker": ("maxent_ne_chunker", "chunkers/maxent_ne_chunker"),
+    "words": ("words", "corpora/words"),
+}
+CURRENT_RESOURCES = {
+    "tokenizer": ("punkt_tab", "tokenizers/punkt_tab"),
+    "tagger": ("averaged_perceptron_tagger_eng", "taggers/averaged_perceptron_tagger_eng"),
+    "chunker": ("maxent_ne_chunker_tab", "chunkers/maxent_ne_chunker_tab"),
+    "words": ("words", "corpora/words"),
+}
+
+# Looked up in addition to NLTK's own search path
+LOCAL_DATA_PATH = os.environ.get("EXPENSES_NLTK_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nltk_data"))
+
+_nltk = None
+
+
+class MissingNLTKData(RuntimeError):
+    def __init__(self, missing):
+        self.missing = missing
+        super().__init__(
+            "Missing NLTK data: {}. Download it on a machine with network access with "
+            "'python -m nltk.downloader -d {} {}' and copy the folder here.".format(", ".join(missing), LOCAL_DATA_PATH, " ".join(missing))
+        )
+
+
+def load():
+    """Import nltk and check its data on first use, return the nltk module.
+
+    Nothing is downloaded, a missing resource raises MissingNLTKData.
+    """
+    global _nltk
+    if _nltk is not None:
+        return _nltk
+
+    import nltk
+
+    if LOCAL_DATA_PATH not in nltk.data.path:
+        nltk.data.path.insert(0, LOCAL_DATA_PATH)
+
+    missing = [name for name, path in required_resources(nltk).values() if not has_resource(nltk, path)]
+    if missing:
+        raise MissingNLTKData(missing)
+
+    _nltk = nltk
+    return _nltk
+
+
+def required_resources(nltk):
+    """Return the resources the installed NLTK loads, by the step that needs them."""
+    import nltk.tokenize.punkt
+    import nltk.chunk.named_entity
+
+    resources = dict(LEGACY_RESOURCES)
+    # Checked by feature rather than version number, both arrived with the new resource names
+    if hasattr(nltk.tokenize.punkt, "PunktTokenizer"):
+        resources["tokenizer"] = CURRENT_RESOURCES["tokenizer"]
+        resources["tagger"] = CURRENT_RESOURCES["tagger"]
+    if hasattr(nltk.chunk.named_entity, "Maxent_NE_Chunker"):
+        resources["chunker"] = CURRENT_RESOURCES["chunker"]
+
+    return resources
+
+
+def has_resource(nltk, path):
+    try:
+        nltk.data.find(path)
+    except LookupError:
+        return False
+
+    return True
@@ -0,0 +1,193 @@
+import datetime
+import logging
+import nlp
+from cache import LRUCache
+from instrumentation import log, metrics
+from fast_parser import FastParser
+from money import BASE_CURRENCY, CURRENCY_PATTERN, find_amount, find_currency, match_currency, normalize_amount
+
+# Shared by every caller in this process, see FastParser.hit_rate
+fast_parser = FastParser()
+
+# Keys include today's date so "yesterday" and friends expire at midnight
+date_cache = LRUCache(4096)
+message_cache = LRUCache(4096)
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def parse_date_text(text):
+    """Cached dateparser.parse, returns a datetime or None."""
+    key = (normalize(text).casefold(), datetime.date.today())
+    return date_cache.get_or_compute(key, lambda: dateparse(text))
+
+
+def dateparse(text):
+    import dateparser
+
+    with metrics.timer("parse.dateparser"):
+        return dateparser.parse(text)
+
+
+def cache_stats():
+    return {"dates": date_cache.stats(), "messages": message_cache.stats()}
+
+
+def parse_date(tokens):
+    # Checked once so the per-token debug lines cost nothing when disabled
+    debug = log.isEnabledFor(logging.DEBUG)
+    parsed_value = None
+    parsed_date = None
+
+    new_tokens = []
+    for token in tokens:
+        if token == "last" or token == "next" or token == "this":
+            token = token + " " + tokens[tokens.index(token) + 1]
+        
+        new_tokens.append(token)
+
+    for token in new_tokens:
+        parsed_value = token
+
+        if token == "last night":
+            token = "yesterday"
+
+        date = parse_date_text(token)
+
+        if debug:
+            log.debug("date token %r -> %s", token, date)
+        
+        if token.isdigit() and len(token) < 4:
+            continue
+
+        if token.isdigit() and (int(token) < 1900 or int(token) > 2100):
+            continue
+
+        #if token.contains("paid") or token.contains("spent") or token.contains("sent"):
+        #    continue
+
+        if date:
+            if token == "I" or token == "spent" or token == "paid" or token == "sent" or token == "bar":
+                continue
+
+            parsed_date = date.strftime('%Y-%m-%d')
+            break
+
+    if debug:
+        log.debug("parsed date %s from %r", parsed_date, parsed_value)
+
+    if parsed_date:
+        return parsed_date, parsed_value
+
+    return None, None
+
+
+def interpret_message(message, parser=fast_parser):
+    """Return (date, description, amount, currency), trying the regex fast path first."""
+    key = (normalize(message), datetime.date.today())
+    result = message_cache.get(key)
+    if result:
+        return result
+
+    with metrics.timer("parse.message"):
+        with metrics.timer("parse.fast_path"):
+            result = parser.parse(message)
+
+        if not result:
+            result = interpret_message_nlp(message)
+
+    message_cache.put(key, result)
+    return result
+
+
+def interpret_message_nlp(message):
+    nltk = nlp.load()
+
+    with metrics.timer("parse.tokenize"):
+        tokens = nltk.word_tokenize(message)
+    with metrics.timer("parse.pos_tag"):
+        tagged = nltk.pos_tag(tokens)
+    with metrics.timer("parse.ne_chunk"):
+        entities = nltk.ne_chunk(tagged)
+
+    with metrics.timer("parse.parse_date"):
+        date_value, parsed_date_value = parse_date(tokens)
+    description = []
+    amount_text = None
+
+    for subtree in entities:
+        if isinstance(subtree, nltk.Tree):
+            if subtree.label() == 'DATE':
+                date_value = " ".join([token for token, pos in subtree.leaves()])
+            elif subtree.label() == 'MONEY':
+                amount_text = " ".join([token for token, pos in subtree.leaves()])
+        else:
+            description.append(subtree[0])
+
+    description = " ".join(description)
+
+    # Use today's date if no date is found
+    if not date_value:
+        date_value = datetime.date.today().strftime('%Y-%m-%d')
+
+    # Read the amount and its currency from NLTK's MONEY entity, else from the message
+    amount_match = find_amount(amount_text or "") or find_amount(message)
+    amount = None
+    currency = None
+    if amount_match:
+        amount = normalize_amount(amount_match.group("amount"))
+        currency = match_currency(amount_match)
+
+    # If no amount is found, set a default value
+    if not amount:
+        amount = "0.00"
+
+    currency = currency or find_currency(message) or BASE_CURRENCY
+
+    # Heuristic to improve description extraction
+    if date_value and date_value in description:
+        description = description.replace(date_value, "").strip()
+
+    if amount_match and amount_match.group("amount") in description:
+        description = description.replace(amount_match.group("amount"), "").strip()
+        
+    if parsed_date_value and parsed_date_value in description:
+        description = description.replace(parsed_date_value, "").strip()
+
+    no_no_pharses = [
+        "I spent",
+        "I paid",
+        "I sent",
+        "I paid for",
+        "I spent for",
+        "I sent for",
+        "I spent on",
+        "I sent on",
+        "I paid on",
+        "paid",
+        "spent",
+        "sent",
+    ]
+
+    # Currency symbols, codes and words belong to the amount
+    description = " ".join(CURRENCY_PATTERN.sub("", description).split())
+
+    for phrase in no_no_pharses:
+        description = description.replace(phrase.casefold(), "").strip()
+
+    no_no_pharses_at_end_or_start = [
+        "on",
+        "for",
+        "to",
+        "I",
+    ]
+
+    for phrase in no_no_pharses_at_end_or_start:
+        if description.startswith(phrase):
+            description = description[len(phrase):].strip()
+        if description.endswith(phrase):
+            description = description[:-len(phrase)].strip()
+
+    return date_value, description, amount, currency
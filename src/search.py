@@ -0,0 +1,98 @@
+import bisect
+import datetime
+import re
+import numpy as np
+from columns import index_array
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Split text into case-folded word tokens."""
+    return TOKEN.findall(text.casefold())
+
+
+class SearchIndex:
+    """Inverted index from description tokens to ledger rows.
+
+    Ledgers repeat the same few descriptions over and over, so terms point at
+    the codes of the ledger's dictionary encoded description column. A query
+    is matched against the distinct descriptions first and then turned into
+    rows with one vectorized pass over the row codes.
+
+    Every query token matches as a prefix through the sorted term list, so
+    typing "gro" already finds "groceries". Deleted flags aren't indexed,
+    they are filtered when the rows are returned.
+    """
+
+    def __init__(self):
+        self.indexed = 0
+        self.term_codes = {}
+        self.terms = []
+        self._codes = None
+        self._ordinals = None
+
+    def update(self, descriptions):
+        """Index the distinct descriptions of a DictionaryColumn added since the last update."""
+        for code in range(self.indexed, len(descriptions.values)):
+            for term in set(tokenize(descriptions.values[code])):
+                if term not in self.term_codes:
+                    bisect.insort(self.terms, term)
+                    self.term_codes[term] = set()
+                self.term_codes[term].add(code)
+
+        self.indexed = len(descriptions.values)
+
+    def prefix_codes(self, prefix):
+        codes = set()
+        position = bisect.bisect_left(self.terms, prefix)
+        while position < len(self.terms) and self.terms[position].startswith(prefix):
+            codes |= self.term_codes[self.terms[position]]
+            position += 1
+
+        return codes
+
+    def match(self, text):
+        """Return the description codes matching every token of text, or None for an empty query."""
+        tokens = tokenize(text)
+        if not tokens:
+            return None
+
+        codes = None
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matched = self.prefix_codes(token)
+            codes = matched if codes is None else codes & matched
+            if not codes:
+                break
+
+        return codes
+
+    def arrays(self, ledger):
+        # Codes and ordinals only ever grow, the deleted flags change in place
+        codes = ledger.descriptions.codes
+        if self._codes is None or len(self._codes) != len(codes):
+            self._codes = np.array(codes, dtype=np.int64)
+            self._ordinals = np.array(ledger.ordinals, dtype=np.int64)
+
+        return self._codes, self._ordinals, ledger.deleted_flags()
+
+    def search(self, ledger, text, start_date=None, end_date=None, deleted=False):
+        """Return the matching ledger rows, in date order when a range is given, or None for an empty query."""
+        codes = self.match(text)
+        if codes is None:
+            return None
+
+        if not codes:
+            return index_array([])
+
+        row_codes, ordinals, deleted_flags = self.arrays(ledger)
+        mask = np.isin(row_codes, np.fromiter(codes, dtype=np.int64, count=len(codes)))
+        mask &= deleted_flags == deleted
+
+        if start_date is None and end_date is None:
+            return index_array(np.flatnonzero(mask))
+
+        mask &= ordinals >= (start_date or datetime.date.min).toordinal()
+        mask &= ordinals <= (end_date or datetime.date.max).toordinal()
+        rows = np.flatnonzero(mask)
+        return index_array(rows[np.argsort(ordinals[rows], kind="stable")])
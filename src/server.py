@@ -0,0 +1,340 @@
+"""Local HTTP/JSON API over the expense engine.
+
+    POST /messages        {"message": "spent 12.50 on lunch"}
+    POST /messages/bulk   {"messages": ["...", "..."]}
+    GET  /expenses        ?period=month&date=2024-05-01 or ?start=...&end=..., &deleted=1
+    GET  /totals          ?date=2024-05-01
+    GET  /metrics
+
+Totals are in the base currency, see money.BASE_CURRENCY.
+"""
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import urllib.parse
+import importer
+import nlp
+import parsing
+from instrumentation import log, metrics
+from money import BASE_CURRENCY, format_cents, to_cents
+from totals import PERIODS
+
+# Requests with a larger body are refused
+MAX_BODY = 16 * 1024 * 1024
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(message)
+
+
+def warm_worker():
+    # Load NLTK's models and dateparser once per worker instead of on the first request
+    try:
+        parsing.interpret_message_nlp("warm up 1.00 the day before yesterday at the bar")
+    except Exception as error:
+        # A broken initializer would take the whole pool down, requests report the error instead
+        log.warning("Parse worker started cold: %s", error)
+
+
+class ExpenseServer:
+    """asyncio HTTP server in front of an ExpenseEngine.
+
+    Messages the regex fast path understands are parsed on the event loop,
+    the rest go to a process pool whose workers load the NLP models when
+    they start. Ledger work runs on a single thread. Writes that arrive
+    while the previous one is being saved are queued and saved together
+    with one add_many call.
+    """
+
+    # Most expenses a single batched write takes from the queue
+    batch_size = 5000
+    # Messages per process pool task in a bulk request
+    chunk_size = 200
+
+    def __init__(self, engine, workers=None):
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="expenses-io")
+        self.pool = None
+        self.writes = None
+        self.writer = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.pool = importer.process_pool(self.workers, warm_worker)
+        self.writes = asyncio.Queue()
+        self.writer = asyncio.create_task(self.write_batches())
+        server = await asyncio.start_server(self.handle, host, port)
+        log.warning("Serving on http://%s:%s with %d parse workers", host, port, self.workers)
+        return server
+
+    async def close(self):
+        if self.writer:
+            self.writer.cancel()
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+
+        await self.run(self.engine.close)
+        self.io.shutdown()
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io, function, *args)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                method, path, query, body, keep_alive = request
+                status, payload = await self.dispatch(method, path, query, body)
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except HTTPError as error:
+            await write_response(writer, error.status, {"error": str(error)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, method, path, query, body):
+        routes = {
+            "/messages": ("POST", self.add_message),
+            "/messages/bulk": ("POST", self.add_messages),
+            "/expenses": ("GET", self.expenses),
+            "/totals": ("GET", self.totals),
+            "/metrics": ("GET", self.metrics),
+        }
+
+        try:
+            if path not in routes:
+                raise HTTPError(404, "No such endpoint " + path)
+
+            route_method, handler = routes[path]
+            if method != route_method:
+                raise HTTPError(405, "Use " + route_method)
+
+            with metrics.timer("server" + path.replace("/", ".")):
+                if method == "POST":
+                    return await handler(parse_json(body))
+
+                return await handler(query)
+        except HTTPError as error:
+            return error.status, {"error": str(error)}
+        except nlp.MissingNLTKData as error:
+            return 503, {"error": str(error)}
+        except Exception as error:
+            log.exception("Request to %s failed", path)
+            return 500, {"error": str(error)}
+
+    async def parse(self, message):
+        # The regex is a few microseconds, only messages it can't read cross into a worker
+        result = self.engine.parser.parse(message)
+        if result:
+            return result
+
+        return await asyncio.get_running_loop().run_in_executor(self.pool, parsing.interpret_message, message)
+
+    async def save(self, expenses):
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((expenses, future))
+        return await future
+
+    async def write_batches(self):
+        while True:
+            batch = [await self.writes.get()]
+            count = len(batch[0][0])
+            while not self.writes.empty() and count < self.batch_size:
+                batch.append(self.writes.get_nowait())
+                count += len(batch[-1][0])
+
+            expenses = [expense for items, _ in batch for expense in items]
+            try:
+                expense_ids = await self.run(self.engine.add_many, expenses)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            metrics.count("server.batched_writes")
+            position = 0
+            for items, future in batch:
+                # The client may have gone away, its expenses are saved all the same
+                if not future.done():
+                    future.set_result(expense_ids[position:position + len(items)])
+                position += len(items)
+
+    async def add_message(self, body):
+        message = body.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "Expected {\"message\": \"...\"}")
+
+        date, description, amount, currency = await self.parse(message)
+        [expense_id] = await self.save([(date, description, amount, currency)])
+        # The amount as it was saved, "30" is stored as "30.00"
+        return 201, {"id": expense_id, "date": date, "description": description, "amount": format_cents(to_cents(amount)), "currency": currency}
+
+    async def add_messages(self, body):
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+            raise HTTPError(400, "Expected {\"messages\": [\"...\", ...]}")
+
+        parsed = {}
+        misses = []
+        for index, message in enumerate(messages):
+            result = self.engine.parser.parse(message)
+            if result:
+                parsed[index] = result
+            else:
+                misses.append((index, message))
+
+        errors = []
+        loop = asyncio.get_running_loop()
+        chunks = [loop.run_in_executor(self.pool, importer.parse_chunk, chunk) for chunk in importer.chunked(misses, self.chunk_size)]
+        for results, _, _ in await asyncio.gather(*chunks):
+            for index, message, result, error in results:
+                if error is None:
+                    parsed[index] = result
+                else:
+                    errors.append({"index": index, "message": message, "error": error})
+
+        order = sorted(parsed)
+        expense_ids = await self.save([parsed[index] for index in order]) if order else []
+        expenses = [{"index": index, "id": expense_id, "date": parsed[index][0], "description": parsed[index][1], "amount": format_cents(to_cents(parsed[index][2])), "currency": parsed[index][3]} for index, expense_id in zip(order, expense_ids)]
+
+        return 201, {"imported": len(expenses), "expenses": expenses, "errors": sorted(errors, key=lambda error: error["index"])}
+
+    async def expenses(self, query):
+        deleted = query_flag(query, "deleted")
+        period = query.get("period")
+
+        if period:
+            if period not in PERIODS:
+                raise HTTPError(400, "period must be one of " + ", ".join(PERIODS))
+            date = query_date(query, "date")
+            rows, total = await self.run(self.engine.period_view, period, date, deleted)
+        else:
+            start_date = query_date(query, "start")
+            end_date = query_date(query, "end")
+            rows, total = await self.run(self.engine.view, start_date, end_date, deleted)
+
+        records = await self.run(self.engine.records, rows)
+        return 200, {"expenses": records, "count": len(records), "total": format_cents(total), "total_cents": total, "currency": BASE_CURRENCY}
+
+    async def totals(self, query):
+        date = query_date(query, "date") or datetime.date.today()
+        totals = await self.run(self.engine.totals, date)
+        return 200, {"date": date.isoformat(), "totals": {period: format_cents(cents) for period, cents in totals.items()}, "totals_cents": totals, "currency": BASE_CURRENCY}
+
+    async def metrics(self, query):
+        return 200, metrics.snapshot()
+
+
+async def read_request(reader):
+    """Return (method, path, query, body, keep_alive), None once the client closed the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Content-Length must be a number")
+
+    if length < 0:
+        raise HTTPError(400, "Content-Length must not be negative")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Body larger than {} bytes".format(MAX_BODY))
+    body = await reader.readexactly(length) if length else b""
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+    url = urllib.parse.urlsplit(target)
+    query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+    return method.upper(), url.path.rstrip("/") or "/", query, body, keep_alive
+
+
+async def write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode("utf-8")
+    head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status, REASONS[status], len(body), "keep-alive" if keep_alive else "close")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+def parse_json(body):
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body is not valid JSON")
+
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+
+    return data
+
+
+def query_date(query, name):
+    if not query.get(name):
+        return None
+
+    try:
+        return datetime.date.fromisoformat(query[name])
+    except ValueError:
+        raise HTTPError(400, "{} must be an ISO date".format(name))
+
+
+def query_flag(query, name):
+    return query.get(name, "").lower() in ("1", "true", "yes")
+
+
+def serve(engine, host="127.0.0.1", port=8765, workers=None):
+    """Run the API until interrupted."""
+    async def main():
+        server = ExpenseServer(engine, workers)
+        listener = await server.start(host, port)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
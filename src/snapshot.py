@@ -0,0 +1,206 @@
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from instrumentation import log, metrics
+from storage import fsync_directory
+
+MAGIC = b"EXPSNAP3"
+# Magic, then the length of the JSON header that follows it
+PREFIX = struct.Struct("<8sQ")
+# Bytes of the log before the snapshot's offset covered by the checksum
+CHECKSUM_BYTES = 65536
+
+# Sections in file order, with the array typecode they are read into
+SECTIONS = (
+    ("ids", "q"),
+    ("ordinals", "i"),
+    ("cents", "q"),
+    ("deleted", "B"),
+    ("description_codes", "i"),
+    ("description_offsets", "q"),
+    ("description_heap", "B"),
+    ("sorted_rows", "q"),
+    ("sorted_ordinals", "i"),
+    ("currency_codes", "i"),
+    ("date_text_rows", "q"),
+    ("date_text_offsets", "q"),
+    ("date_text_heap", "B"),
+)
+
+
+class Snapshot:
+    """Binary copy of the ledger columns at a known point of the log.
+
+    The file is a small JSON header followed by fixed-width sections: ids,
+    date ordinals, cents, the packed deleted bits, description codes, the
+    distinct descriptions as offsets into a UTF-8 heap and the sorted date
+    index, then currency codes and the rows whose date isn't an ISO date,
+    with their date text as offsets into a second heap. Opening it maps the
+    file and copies each section straight into its array, nothing is parsed
+    per row.
+
+    The header carries the store state the columns match, the distinct
+    currencies, the running totals at that point with the exchange rates
+    they were converted at, and a CRC32 of the last CHECKSUM_BYTES of the log
+    before the offset, so a snapshot of another log or of a rewritten log
+    is never used.
+    """
+
+    def __init__(self, state, rows, columns, descriptions, currencies, date_text, totals, rates):
+        self.state = state
+        self.rows = rows
+        self.columns = columns
+        self.descriptions = descriptions
+        self.currencies = currencies
+        self.date_text = date_text
+        self.totals = totals
+        self.rates = rates
+
+    @classmethod
+    @metrics.timed("snapshot.load")
+    def load(cls, file_path, log_path):
+        """Open a snapshot, return None if it is missing, damaged or doesn't match the log."""
+        try:
+            file = open(file_path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        with file:
+            try:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return cls.from_buffer(mapped, log_path)
+            except (OSError, ValueError, KeyError, struct.error) as error:
+                log.warning("Ignoring snapshot %s: %s", file_path, error)
+                return None
+
+    @classmethod
+    def from_buffer(cls, mapped, log_path):
+        magic, header_size = PREFIX.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError("not a snapshot, or one written by an older version")
+
+        header = json.loads(mapped[PREFIX.size:PREFIX.size + header_size])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("written on a machine with another byte order")
+
+        state = header["state"]
+        if log_checksum(log_path, state["offset"]) != header["checksum"]:
+            log.info("Snapshot is for another version of %s", log_path)
+            return None
+
+        columns = {}
+        position = align(PREFIX.size + header_size)
+        view = memoryview(mapped)
+        try:
+            for name, typecode in SECTIONS:
+                column = array.array(typecode)
+                size = header["sections"][name]
+                if position + size > len(mapped):
+                    raise ValueError("truncated")
+
+                column.frombytes(view[position:position + size])
+                columns[name] = column
+                position = align(position + size)
+        finally:
+            view.release()
+
+        descriptions = decode_texts(columns.pop("description_offsets"), columns.pop("description_heap"))
+        date_text = dict(zip(columns.pop("date_text_rows"), decode_texts(columns.pop("date_text_offsets"), columns.pop("date_text_heap"))))
+        totals = {(period, key): cents for period, key, cents in header["totals"]}
+
+        return cls(state, header["rows"], columns, descriptions, header["currencies"], date_text, totals, header["rates"])
+
+
+@metrics.timed("snapshot.save")
+def save(file_path, ledger):
+    """Write the ledger's columns and its store state to file_path."""
+    store = ledger.store
+    state = store.state()
+
+    description_offsets, description_heap = encode_texts(ledger.descriptions.values)
+    date_text_offsets, date_text_heap = encode_texts(ledger.date_text.values())
+
+    sections = {
+        "ids": ledger.ids.tobytes(),
+        "ordinals": ledger.ordinals.tobytes(),
+        "cents": ledger.cents.tobytes(),
+        "deleted": bytes(ledger.deleted.bits),
+        "description_codes": ledger.descriptions.codes.tobytes(),
+        "description_offsets": description_offsets.tobytes(),
+        "description_heap": description_heap,
+        "currency_codes": ledger.currencies.codes.tobytes(),
+        "sorted_rows": ledger.sorted_rows.tobytes(),
+        "sorted_ordinals": ledger.sorted_ordinals.tobytes(),
+        "date_text_rows": array.array("q", ledger.date_text.keys()).tobytes(),
+        "date_text_offsets": date_text_offsets.tobytes(),
+        "date_text_heap": date_text_heap,
+    }
+
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "state": state,
+        "checksum": log_checksum(store.file_path, state["offset"]),
+        "rows": len(ledger.ids),
+        "sections": {name: len(data) for name, data in sections.items()},
+        "currencies": ledger.currencies.values,
+        "totals": [[period, key, cents] for (period, key), cents in ledger.totals.totals.items()],
+        "rates": ledger.rates.key(),
+    }).encode("utf-8")
+
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(PREFIX.pack(MAGIC, len(header)))
+        file.write(header)
+        position = PREFIX.size + len(header)
+        for name, _ in SECTIONS:
+            # Pad so every section starts on an eight byte boundary
+            file.write(b"\0" * (align(position) - position))
+            position = align(position)
+
+            file.write(sections[name])
+            position += len(sections[name])
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, file_path)
+    fsync_directory(file_path)
+    return state
+
+
+def encode_texts(texts):
+    """Return (offsets, heap) for a list of strings, string i is heap[offsets[i]:offsets[i + 1]]."""
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = array.array("q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    return offsets, b"".join(encoded)
+
+
+def decode_texts(offsets, heap):
+    heap = heap.tobytes()
+    return [heap[offsets[index]:offsets[index + 1]].decode("utf-8") for index in range(len(offsets) - 1)]
+
+
+def log_checksum(log_path, offset):
+    """CRC32 of the log bytes just before offset, None if the log is shorter than that."""
+    try:
+        with open(log_path, 'rb') as file:
+            start = max(0, offset - CHECKSUM_BYTES)
+            file.seek(start)
+            data = file.read(offset - start)
+    except FileNotFoundError:
+        return None
+
+    if len(data) != offset - start:
+        return None
+
+    return zlib.crc32(data)
+
+
+def align(position):
+    return (position + 7) & ~7
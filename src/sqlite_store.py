@@ -0,0 +1,396 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+import fx
+from ledger import date_to_ordinal
+from instrumentation import metrics
+from journal import UndoJournal
+from money import BASE_CURRENCY, DEFAULT_CURRENCY, to_cents, to_decimal, format_cents
+from storage import expense_fields
+from search import tokenize
+from totals import RunningTotals, period_keys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    currency TEXT NOT NULL DEFAULT 'USD',
+    base_cents INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS expenses_deleted_date ON expenses (deleted, date);
+CREATE TABLE IF NOT EXISTS totals (
+    period TEXT NOT NULL,
+    key TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (period, key)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS expenses_search USING fts5(description, content='expenses', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS expenses_search_insert AFTER INSERT ON expenses BEGIN
+    INSERT INTO expenses_search (rowid, description) VALUES (new.id, new.description);
+END;
+"""
+
+# Databases created before amounts had a currency get these columns added
+CURRENCY_COLUMNS = (
+    "ALTER TABLE expenses ADD COLUMN currency TEXT NOT NULL DEFAULT 'USD'",
+    "ALTER TABLE expenses ADD COLUMN base_cents INTEGER NOT NULL DEFAULT 0",
+)
+
+# What a row tuple holds, in order
+ROW_COLUMNS = "id, date, description, amount_cents, currency, base_cents, deleted"
+
+UPSERT_TOTAL = "INSERT INTO totals (period, key, cents) VALUES (?, ?, ?) ON CONFLICT (period, key) DO UPDATE SET cents = cents + excluded.cents"
+
+# Thursday of a date's ISO week, its year and day of the year give the ISO week number
+ISO_THURSDAY = "date(date, '+3 days', '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days')"
+
+# SQLite expressions for the key of each breakdown period, the same keys as totals.period_keys, dates are ISO text
+PERIOD_EXPRESSIONS = {
+    "day": "date",
+    "week": "strftime('%Y', " + ISO_THURSDAY + ") || '-W' || printf('%02d', (CAST(strftime('%j', " + ISO_THURSDAY + ") AS INTEGER) - 1) / 7 + 1)",
+    "month": "substr(date, 1, 7)",
+    "year": "substr(date, 1, 4)",
+}
+
+
+class SQLiteLedger:
+    """Expense ledger backed by SQLite instead of an in-memory copy.
+
+    Offers the same query interface as Ledger, but views, totals and
+    breakdowns run as indexed SELECTs and only the rows a view shows are
+    loaded. Amounts are stored as integer cents in their own currency and,
+    converted at the rate of their date, in the base currency. A row is the
+    tuple (id, date, description, amount_cents, currency, base_cents, deleted).
+
+    The totals table holds running per-day, per-week, per-month and per-year
+    sums in the base currency, updated in the same transaction as every
+    insert, delete and restore. When the rates file or the base currency
+    changes the base amounts are converted again and the totals rebuilt.
+    Descriptions are indexed by an FTS5 table kept in sync by a trigger.
+    """
+
+    def __init__(self, file_path="expenses.db", rates=None):
+        self.file_path = file_path
+        self.rates = rates or fx.RateTable.load()
+        self.lock = threading.RLock()
+        # Used from the Tk thread and the io worker, the lock serializes access
+        self.connection = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        # Databases created before search existed need their descriptions indexed once
+        indexed = self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'expenses_search'").fetchall()
+        self.connection.executescript(SCHEMA)
+        if not indexed:
+            self.connection.execute("INSERT INTO expenses_search (expenses_search) VALUES ('rebuild')")
+
+        columns = [row[1] for row in self.execute("PRAGMA table_info(expenses)")]
+        if "currency" not in columns:
+            for statement in CURRENCY_COLUMNS:
+                self.connection.execute(statement)
+
+        if self.setting("rates") != json.dumps(self.rates.key()):
+            self.convert_amounts()
+        elif not self.execute("SELECT 1 FROM totals LIMIT 1") and self.execute("SELECT 1 FROM expenses LIMIT 1"):
+            self.rebuild_totals()
+
+        # SQLite does the locking between processes, data_version tells us when another connection committed
+        self.data_version = self.execute("PRAGMA data_version")[0][0]
+        self.refreshes = 0
+        self.journal = UndoJournal()
+
+    def refresh(self):
+        """Return True if another process changed the database since the last call.
+
+        Every query reads the database, so there is nothing to reload.
+        """
+        rates_changed = self.refresh_rates()
+        data_version = self.execute("PRAGMA data_version")[0][0]
+        if data_version == self.data_version:
+            return rates_changed
+
+        self.data_version = data_version
+        self.refreshes += 1
+        return True
+
+    def execute(self, sql, parameters=()):
+        with self.lock, metrics.timer("storage.query"):
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def refresh_rates(self):
+        """Convert the base amounts again if the rates file was edited, return True if it was."""
+        if not self.rates.changed():
+            return False
+
+        self.rates = self.rates.reload()
+        self.convert_amounts()
+        return True
+
+    def setting(self, name):
+        rows = self.execute("SELECT value FROM settings WHERE name = ?", (name,))
+        return rows[0][0] if rows else None
+
+    def add(self, date, description, amount, currency=BASE_CURRENCY):
+        return self.add_many([(date, description, amount, currency)])[0]
+
+    def transaction(self, function):
+        with self.lock, metrics.timer("storage.transaction"):
+            self.connection.execute("BEGIN")
+            try:
+                result = function()
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+        return result
+
+    def update_totals(self, rows, sign=1):
+        # rows are (date, cents) pairs, unparsable dates have no period to count under
+        totals = RunningTotals()
+        for date, cents in rows:
+            try:
+                totals.add(datetime.date.fromisoformat(date), cents * sign)
+            except ValueError:
+                pass
+
+        self.connection.executemany(UPSERT_TOTAL, [(period, key, cents) for (period, key), cents in totals.totals.items()])
+
+    def rebuild_totals(self):
+        self.transaction(self.write_totals)
+
+    def write_totals(self):
+        self.connection.execute("DELETE FROM totals")
+        self.update_totals(self.connection.execute("SELECT date, SUM(base_cents) FROM expenses WHERE deleted = 0 GROUP BY date").fetchall())
+
+    @metrics.timed("storage.convert")
+    def convert_amounts(self):
+        """Convert every amount into the base currency at the current rates and rebuild the totals."""
+        def convert():
+            self.connection.execute("UPDATE expenses SET base_cents = amount_cents WHERE currency = ?", (self.rates.base,))
+
+            rows = self.connection.execute("SELECT id, date, amount_cents, currency FROM expenses WHERE currency != ?", (self.rates.base,)).fetchall()
+            if rows:
+                expense_ids, dates, cents, currencies = zip(*rows)
+                values = sorted(set(currencies))
+                codes = [values.index(currency) for currency in currencies]
+                converted = self.rates.convert(cents, codes, values, [date_to_ordinal(date) for date in dates])
+                self.connection.executemany("UPDATE expenses SET base_cents = ? WHERE id = ?", zip(converted.tolist(), expense_ids))
+
+            self.write_totals()
+            self.connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('rates', ?)", (json.dumps(self.rates.key()),))
+
+        self.transaction(convert)
+
+    def converted_row(self, date, description, amount, currency):
+        date = normalize_date(date)
+        cents = to_cents(amount)
+        return date, description, cents, currency, self.rates.convert_one(cents, currency, date_to_ordinal(date))
+
+    def add_many(self, expenses):
+        rows = [self.converted_row(*expense_fields(expense)) for expense in expenses]
+
+        def insert():
+            expense_ids = [self.connection.execute("INSERT INTO expenses (date, description, amount_cents, currency, base_cents) VALUES (?, ?, ?, ?, ?)", row).lastrowid for row in rows]
+            self.update_totals([(row[0], row[4]) for row in rows])
+            return expense_ids
+
+        return self.transaction(insert)
+
+    def set_deleted(self, expense_id, deleted):
+        return bool(self.set_deleted_many([expense_id], deleted))
+
+    def set_deleted_many(self, expense_ids, deleted, journal=True):
+        """Delete (or restore) expenses in one transaction, return the ids whose flag changed.
+
+        The batch goes into the undo journal unless journal is False.
+        """
+        expense_ids = list(expense_ids)
+
+        def update():
+            rows = []
+            # Chunked to stay under SQLite's limit on bound parameters
+            for start in range(0, len(expense_ids), 500):
+                chunk = expense_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows += self.connection.execute("SELECT id, date, base_cents FROM expenses WHERE deleted != ? AND id IN (" + placeholders + ")", [int(deleted)] + chunk).fetchall()
+
+            self.connection.executemany("UPDATE expenses SET deleted = ? WHERE id = ?", [(int(deleted), row[0]) for row in rows])
+            self.update_totals([(date, cents) for _, date, cents in rows], -1 if deleted else 1)
+            return [row[0] for row in rows]
+
+        changed = self.transaction(update)
+        if changed and journal:
+            self.journal.record(changed, deleted)
+
+        return changed
+
+    def delete(self, expense_id):
+        return self.set_deleted(expense_id, True)
+
+    def restore(self, expense_id):
+        return self.set_deleted(expense_id, False)
+
+    def undo(self):
+        """Reverse the newest delete or restore batch, return (changed ids, deleted flag they now have) or None."""
+        batch = self.journal.pop()
+        if batch is None:
+            return None
+
+        expense_ids, deleted = batch
+        return self.set_deleted_many(expense_ids, not deleted, journal=False), not deleted
+
+    def where(self, start_date, end_date, deleted):
+        clause = "deleted = ?"
+        parameters = [int(deleted)]
+
+        if start_date is not None:
+            clause += " AND date >= ?"
+            parameters.append(start_date.isoformat())
+        if end_date is not None:
+            clause += " AND date <= ?"
+            parameters.append(end_date.isoformat())
+
+        return clause, parameters
+
+    def view(self, start_date=None, end_date=None, deleted=False, period=None):
+        """Return (rows, total in cents) for a date range, both resolved by the (deleted, date) index.
+
+        With period set the total comes from the totals table instead of a SUM.
+        """
+        self.refresh_rates()
+        clause, parameters = self.where(start_date, end_date, deleted)
+        with self.lock:
+            rows = self.execute("SELECT " + ROW_COLUMNS + " FROM expenses WHERE " + clause + " ORDER BY date, id", parameters)
+
+            if period and not deleted:
+                key = dict(period_keys(start_date))[period]
+                total = self.execute("SELECT cents FROM totals WHERE period = ? AND key = ?", (period, key))
+                total = total[0][0] if total else 0
+            else:
+                total = self.execute("SELECT COALESCE(SUM(base_cents), 0) FROM expenses WHERE " + clause, parameters)[0][0]
+
+        return rows, total
+
+    def search(self, text, start_date=None, end_date=None, deleted=False):
+        """Return (rows, total in cents) of expenses whose description matches every word of text as a prefix."""
+        tokens = tokenize(text)
+        if not tokens:
+            return self.view(start_date, end_date, deleted)
+
+        # Tokens are plain word characters, quoting them keeps FTS5 operators out of the query
+        query = " ".join('"{}"*'.format(token) for token in tokens)
+        self.refresh_rates()
+        clause, parameters = self.where(start_date, end_date, deleted)
+        rows = self.execute("SELECT " + ROW_COLUMNS + " FROM expenses WHERE id IN (SELECT rowid FROM expenses_search WHERE expenses_search MATCH ?) AND " + clause + " ORDER BY date, id", [query] + parameters)
+
+        return rows, sum(row[5] for row in rows)
+
+    def row_values(self, row):
+        amount = format_cents(row[3])
+        if row[4] != self.rates.base:
+            amount += " " + row[4]
+
+        return str(row[0]), (row[1], row[2], amount)
+
+    def record_values(self, row):
+        return row[1], row[2], to_decimal(row[3]), row[4]
+
+    def record(self, row):
+        return {"id": row[0], "date": row[1], "description": row[2], "amount": format_cents(row[3]), "currency": row[4], "deleted": bool(row[6])}
+
+    def ids_of(self, rows):
+        """Return the ids of the given rows as an int64 NumPy array."""
+        return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+    def row_of(self, expense_id):
+        rows = self.execute("SELECT " + ROW_COLUMNS + " FROM expenses WHERE id = ?", (expense_id,))
+        return rows[0] if rows else None
+
+    def amount_cents(self, expense_id):
+        """Return the amount of an expense in base currency cents."""
+        row = self.row_of(expense_id)
+        return row[5] if row else 0
+
+    def group_by(self, period, deleted=False):
+        import pandas as pd
+
+        self.refresh_rates()
+        expression = PERIOD_EXPRESSIONS[period]
+        rows = self.execute("SELECT " + expression + " AS period, COUNT(*), SUM(base_cents) FROM expenses WHERE deleted = ? GROUP BY period ORDER BY period", (int(deleted),))
+
+        return pd.DataFrame({
+            "period": [row[0] for row in rows],
+            "count": [row[1] for row in rows],
+            "total": [row[2] / 100 for row in rows],
+        })
+
+    def by_description(self, deleted=False):
+        import pandas as pd
+
+        self.refresh_rates()
+        rows = self.execute("SELECT description, COUNT(*), SUM(base_cents) AS total FROM expenses WHERE deleted = ? GROUP BY description ORDER BY total DESC", (int(deleted),))
+
+        return pd.DataFrame({
+            "description": [row[0] for row in rows],
+            "count": [row[1] for row in rows],
+            "total": [row[2] / 100 for row in rows],
+        })
+
+    def migrate_from_json(self, json_path="expenses.json"):
+        """Copy expenses.json into an empty database, keeping deleted flags."""
+        if not os.path.exists(json_path) or self.execute("SELECT COUNT(*) FROM expenses")[0][0]:
+            return 0
+
+        with open(json_path, 'r') as file:
+            data = json.load(file)
+
+        return self.import_records(data)
+
+    def migrate_from_store(self, store):
+        """Copy the records of an ExpenseStore log into an empty database."""
+        if self.execute("SELECT COUNT(*) FROM expenses")[0][0]:
+            return 0
+
+        return self.import_records(store.records.values())
+
+    def import_records(self, records):
+        rows = [self.converted_row(record["date"], record["description"], record["amount"], record.get("currency", DEFAULT_CURRENCY)) + (int(bool(record.get("deleted"))),) for record in records]
+
+        def insert():
+            self.connection.executemany("INSERT INTO expenses (date, description, amount_cents, currency, base_cents, deleted) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.update_totals([(row[0], row[4]) for row in rows if not row[5]])
+
+        self.transaction(insert)
+        return len(rows)
+
+    def save_totals(self):
+        # Totals are written with every change already
+        pass
+
+    def update_snapshot(self):
+        # Pages are read on demand, opening a database is already instant
+        return False
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def normalize_date(date):
+    # Range queries compare ISO text, so store every date we can parse in that form
+    ordinal = date_to_ordinal(date)
+    if ordinal == 0:
+        return date
+
+    return datetime.date.fromordinal(ordinal).isoformat()
@@ -0,0 +1,472 @@
+import json
+import os
+import threading
+from instrumentation import metrics
+from money import BASE_CURRENCY, DEFAULT_CURRENCY, format_cents, to_cents
+
+
+class CorruptLogError(ValueError):
+    """A line in the middle of the log isn't a valid entry.
+
+    Nothing after it is replayed or touched, the log has to be fixed by hand.
+    """
+
+
+class ExpenseStore:
+    """Append-only expense log with tombstones for the deleted flag.
+
+    Every mutation is a single JSON line appended to the log:
+    {"op": "add", "id": 1, "date": ..., "description": ..., "amount": ..., "currency": "EUR"}
+    {"op": "delete", "id": 1}
+    {"op": "restore", "id": 1}
+
+    The currency is left out for USD, so logs written before amounts had a
+    currency read back as USD.
+
+    A last line without a newline is a torn append and is cut off. Any
+    other line that can't be read stops the replay with CorruptLogError
+    and the log is left untouched.
+
+    Several processes can share one log. Writers take an exclusive lock on
+    <log>.lock, catch up with whatever the others appended, then append, so
+    ids never collide and nothing is lost. Readers remember the byte offset
+    they have replayed up to and only read what was appended after it.
+
+    A rewritten log starts with {"op": "version", "version": 2}. Readers
+    check it before reading on from their offset, so a compaction by another
+    process is noticed even if the new file got the old one's inode back.
+
+    The log is replayed on first use. A store resumed from a snapshot skips
+    the replay and only reads on from the snapshot's offset, the records
+    dict is then filled in the first time something asks for it.
+    """
+
+    # Compact once there are this many more log lines than live records
+    compact_threshold = 1000
+
+    def __init__(self, file_path="expenses.log"):
+        self.file_path = file_path
+        self._records = None
+        self.record_count = 0
+        self.next_id = 1
+        self.log_lines = 0
+        # Identity of the log file and how far into it we have replayed
+        self.version = 0
+        self.inode = None
+        self.offset = 0
+        self.lock = FileLock(file_path + ".lock")
+
+    @property
+    def records(self):
+        """Dict of id to record, the log is replayed the first time it is needed."""
+        if self._records is None:
+            self.load()
+
+        return self._records
+
+    @metrics.timed("storage.load")
+    def load(self):
+        """Replay the log into memory."""
+        with self.lock:
+            self._records = {}
+            self.record_count = 0
+            self.next_id = 1
+            self.log_lines = 0
+            self.version = 0
+            self.inode = None
+            self.offset = 0
+
+            self.read_new()
+
+    def state(self):
+        """Return what a snapshot needs to resume reading the log where we are now."""
+        return {
+            "version": self.version,
+            "offset": self.offset,
+            "next_id": self.next_id,
+            "log_lines": self.log_lines,
+            "record_count": self.record_count,
+        }
+
+    def resume(self, state, inode):
+        """Continue from a snapshot state instead of replaying the log up to it."""
+        self._records = None
+        self.version = state["version"]
+        self.offset = state["offset"]
+        self.next_id = state["next_id"]
+        self.log_lines = state["log_lines"]
+        self.record_count = state["record_count"]
+        self.inode = inode
+
+    def changed(self):
+        """Cheap check whether the log was appended to or replaced since we last read it."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return self.inode is not None
+
+        return (stat.st_ino, stat.st_size) != (self.inode, self.offset)
+
+    def read_new(self):
+        """Replay the entries appended since the last read and return them.
+
+        Returns None if the log was replaced, e.g. compacted by another
+        process, in which case everything was reloaded from scratch.
+        """
+        with self.lock:
+            if self._records is None and self.inode is None:
+                # First read of a store that wasn't resumed, replay everything
+                self._records = {}
+
+            try:
+                file = open(self.file_path, 'rb')
+            except FileNotFoundError:
+                return []
+
+            with file:
+                stat = os.fstat(file.fileno())
+                replaced = stat.st_ino != self.inode or stat.st_size < self.offset or read_version(file) != self.version
+                if self.inode is not None and replaced:
+                    file.close()
+                    self.load()
+                    return None
+
+                self.inode = stat.st_ino
+                file.seek(self.offset)
+
+                # Everything is parsed before anything is applied, so a bad line leaves the store as it was
+                entries = []
+                offset = self.offset
+                torn = False
+                for line in file:
+                    # Writers hold the lock, so a last line without a newline is a torn write, drop it
+                    if not line.endswith(b"\n"):
+                        torn = True
+                        break
+
+                    entry = parse_entry(line)
+                    if entry is None:
+                        raise CorruptLogError("{} has an unreadable line at byte {}, fix or remove it: {!r}".format(self.file_path, offset, line[:200]))
+
+                    entries.append(entry)
+                    offset += len(line)
+
+            for entry in entries:
+                self.apply(entry)
+            self.offset = offset
+
+            # Only ever cut off the torn last line, never whole entries
+            if torn:
+                with open(self.file_path, 'r+b') as file:
+                    file.truncate(self.offset)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            return entries
+
+    def apply(self, entry):
+        op = entry["op"]
+        expense_id = entry.get("id")
+
+        # Without records only the counters are kept, the records property replays them when asked
+        records = self._records
+
+        if op == "version":
+            self.version = entry["version"]
+        elif op == "add":
+            if records is not None:
+                records[expense_id] = {
+                    "id": expense_id,
+                    "date": entry["date"],
+                    "description": entry["description"],
+                    "amount": entry["amount"],
+                    "currency": entry.get("currency", DEFAULT_CURRENCY),
+                    "deleted": entry.get("deleted", False),
+                }
+            self.record_count += 1
+            self.next_id = max(self.next_id, expense_id + 1)
+        elif op == "delete":
+            if records is not None and expense_id in records:
+                records[expense_id]["deleted"] = True
+        elif op == "restore":
+            if records is not None and expense_id in records:
+                records[expense_id]["deleted"] = False
+
+        self.log_lines += 1
+
+    def append(self, entries):
+        """Write log entries with a single write and fsync.
+
+        Must be called holding the lock after read_new(), so the entries land
+        right after what we have replayed.
+        """
+        data = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+
+        with metrics.timer("storage.append"):
+            with open(self.file_path, 'ab') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                self.inode = os.fstat(file.fileno()).st_ino
+
+        metrics.count("storage.entries_written", len(entries))
+
+        for entry in entries:
+            self.apply(entry)
+        self.offset += len(data)
+
+        if self.log_lines - self.record_count > self.compact_threshold:
+            self.compact()
+
+    def add(self, date, description, amount, currency=BASE_CURRENCY):
+        """Add an expense and return its id."""
+        return self.add_many([(date, description, amount, currency)])[0]
+
+    def add_many(self, expenses):
+        """Add (date, description, amount[, currency]) tuples with a single write, return their ids."""
+        with self.lock:
+            # Ids are only handed out after catching up with the other writers
+            self.read_new()
+
+            entries = []
+            for expense in expenses:
+                date, description, amount, currency = expense_fields(expense)
+                entries.append(add_entry(self.next_id + len(entries), date, description, amount, currency))
+
+            if entries:
+                self.append(entries)
+
+        return [entry["id"] for entry in entries]
+
+    def delete(self, expense_id):
+        return self.set_deleted(expense_id, True)
+
+    def restore(self, expense_id):
+        return self.set_deleted(expense_id, False)
+
+    def set_deleted(self, expense_id, deleted):
+        return bool(self.set_deleted_many([expense_id], deleted))
+
+    def set_deleted_many(self, expense_ids, deleted):
+        """Write a delete (or restore) tombstone for every existing id with a single write, return those ids."""
+        with self.lock:
+            self.read_new()
+
+            op = "delete" if deleted else "restore"
+            entries = [{"op": op, "id": expense_id} for expense_id in expense_ids if self.exists(expense_id)]
+            if entries:
+                self.append(entries)
+
+        return [entry["id"] for entry in entries]
+
+    def signature(self):
+        """Return (mtime, size) of the log, or None if it doesn't exist yet."""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def exists(self, expense_id):
+        if self._records is None:
+            # Ids are handed out in order and records are never dropped, only flagged
+            return 0 < expense_id < self.next_id
+
+        return expense_id in self._records
+
+    def get(self, expense_id):
+        return self.records.get(expense_id)
+
+    @metrics.timed("storage.compact")
+    def compact(self):
+        """Rewrite the log with one add line per record, dropping tombstones."""
+        with self.lock:
+            self.read_new()
+
+            entries = []
+            for record in self.records.values():
+                entry = add_entry(record["id"], record["date"], record["description"], record["amount"], record["currency"])
+                if record["deleted"]:
+                    entry["deleted"] = True
+                entries.append(entry)
+
+            self.write_atomic(entries)
+
+    def write_atomic(self, entries):
+        # Write to a temp file and rename it over the log so a crash never leaves a half written file
+        version = self.version + 1
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({"op": "version", "version": version}) + "\n")
+            for entry in entries:
+                file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+            stat = os.fstat(file.fileno())
+
+        os.replace(temp_path, self.file_path)
+        fsync_directory(self.file_path)
+
+        # Readers in other processes notice the new version and reload
+        self.version = version
+        self.inode = stat.st_ino
+        self.offset = stat.st_size
+        self.log_lines = len(entries) + 1
+
+    def migrate_from_json(self, json_path="expenses.json"):
+        """One-time import of the legacy expenses.json into the log."""
+        with self.lock:
+            # Another instance may have migrated while we waited for the lock
+            if os.path.exists(self.file_path) or not os.path.exists(json_path):
+                return 0
+
+            with open(json_path, 'r') as file:
+                data = json.load(file)
+
+            entries = []
+            for index, expense in enumerate(data, start=1):
+                entry = add_entry(index, expense["date"], expense["description"], expense["amount"], expense.get("currency", DEFAULT_CURRENCY))
+                if expense.get("deleted"):
+                    entry["deleted"] = True
+                entries.append(entry)
+
+            self.write_atomic(entries)
+            self.load()
+
+            # Keep the old file around but make sure it is never migrated twice
+            os.replace(json_path, json_path + ".migrated")
+            return len(entries)
+
+
+# Keys every entry of an op must have
+ENTRY_KEYS = {
+    "version": ("version",),
+    "add": ("id", "date", "description", "amount"),
+    "delete": ("id",),
+    "restore": ("id",),
+}
+
+
+def parse_entry(line):
+    """Return the entry on a log line, None if it isn't valid JSON or lacks the keys of its op."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+
+    if not isinstance(entry, dict) or entry.get("op") not in ENTRY_KEYS:
+        return None
+
+    if not all(key in entry for key in ENTRY_KEYS[entry["op"]]):
+        return None
+
+    return entry
+
+
+def expense_fields(expense):
+    """Return (date, description, amount, currency) for an expense tuple with or without its currency."""
+    if len(expense) == 3:
+        return tuple(expense) + (BASE_CURRENCY,)
+
+    date, description, amount, currency = expense
+    return date, description, amount, currency
+
+
+def add_entry(expense_id, date, description, amount, currency):
+    # Amounts are written as formatted cents, "12.5" and "12.50" are the same line
+    entry = {"op": "add", "id": expense_id, "date": date, "description": description, "amount": format_cents(to_cents(amount))}
+    if currency != DEFAULT_CURRENCY:
+        entry["currency"] = currency
+
+    return entry
+
+
+def read_version(file):
+    """Return the version on the first line of an open log, 0 for a log that was never rewritten."""
+    file.seek(0)
+    try:
+        entry = json.loads(file.readline())
+    except ValueError:
+        return 0
+
+    if entry.get("op") != "version":
+        return 0
+
+    return entry["version"]
+
+
+class FileLock:
+    """Exclusive lock on a file shared by every process using the same log.
+
+    Reentrant within a process, so store methods holding it can call each other.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.file = open(self.file_path, 'a+b')
+                lock_file(self.file)
+            except BaseException:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                self.thread_lock.release()
+                raise
+
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+            self.file.close()
+            self.file = None
+
+        self.thread_lock.release()
+
+
+def lock_file(file):
+    # Blocks until no other process holds the lock
+    with metrics.timer("storage.lock_wait"):
+        if os.name == "nt":
+            import msvcrt
+
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+
+def unlock_file(file):
+    if os.name == "nt":
+        import msvcrt
+
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def fsync_directory(file_path):
+    # Persist the rename itself, not supported on Windows
+    if os.name != "posix":
+        return
+
+    directory = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
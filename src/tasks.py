@@ -0,0 +1,89 @@
+import concurrent.futures
+import queue
+
+
+class TaskExecutor:
+    """Run work off the Tk main loop and deliver results back on it.
+
+    Tasks run on one of two lanes:
+    "io"      a single thread, so ledger and disk work stays in submission order
+    "work"    a thread pool for parsing, exports and other independent jobs
+
+    Callbacks are queued and run by poll(), which reschedules itself with
+    after(), so they are always called on the Tk thread. Tasks submitted with
+    the same key supersede each other: the older one is cancelled if it hasn't
+    started and its result is dropped if it has.
+    """
+
+    poll_interval = 25
+
+    def __init__(self, root, workers=4):
+        self.root = root
+        self.lanes = {
+            "io": concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="expenses-io"),
+            "work": concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="expenses-work"),
+        }
+        self.results = queue.Queue()
+        self.latest = {}
+        self.closed = False
+
+        self.root.after(self.poll_interval, self.poll)
+
+    def submit(self, function, *args, on_done=None, on_error=None, lane="io", key=None):
+        """Run function(*args) on a lane, then on_done(result) or on_error(error) on the Tk thread."""
+        future = self.lanes[lane].submit(function, *args)
+
+        if key is not None:
+            previous = self.latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.latest[key] = future
+
+        future.add_done_callback(lambda future: self.results.put((future, key, on_done, on_error)))
+        return future
+
+    def call_soon(self, function, *args):
+        """Schedule function(*args) on the Tk thread, safe to call from any thread."""
+        self.results.put((None, None, lambda result: function(*args), None))
+
+    def poll(self):
+        while True:
+            try:
+                future, key, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.deliver(future, key, on_done, on_error)
+
+        if not self.closed:
+            self.root.after(self.poll_interval, self.poll)
+
+    def deliver(self, future, key, on_done, on_error):
+        if future is None:
+            on_done(None)
+            return
+
+        if future.cancelled():
+            return
+
+        # A newer task with the same key has replaced this one
+        if key is not None:
+            if self.latest.get(key) is not future:
+                return
+            del self.latest[key]
+
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                self.root.report_callback_exception(type(error), error, error.__traceback__)
+            return
+
+        if on_done:
+            on_done(future.result())
+
+    def shutdown(self):
+        self.closed = True
+        for executor in self.lanes.values():
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,87 @@
+import datetime
+import json
+import os
+from storage import fsync_directory
+
+PERIODS = ("day", "week", "month", "year")
+
+
+def period_keys(date):
+    """Return the day, ISO week, month and year keys a date is counted under."""
+    year, week, _ = date.isocalendar()
+    return (
+        ("day", date.isoformat()),
+        ("week", "{}-W{:02d}".format(year, week)),
+        ("month", "{}-{:02d}".format(date.year, date.month)),
+        ("year", str(date.year)),
+    )
+
+
+def period_range(period, date):
+    """Return the first and last day of the day, week, month or year containing date."""
+    if period == "day":
+        return date, date
+
+    if period == "week":
+        start_date = date - datetime.timedelta(days=date.weekday())
+        return start_date, start_date + datetime.timedelta(days=6)
+
+    if period == "month":
+        start_date = date.replace(day=1)
+        return start_date, (start_date + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+
+    if period == "year":
+        return date.replace(month=1, day=1), date.replace(month=12, day=31)
+
+    raise ValueError("Unknown period {}".format(period))
+
+
+class RunningTotals:
+    """Per-day, per-ISO-week, per-month and per-year totals in integer cents.
+
+    Each insert, delete or restore touches exactly four counters, so the
+    period views read their total without looking at any rows.
+    """
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, date, cents):
+        for key in period_keys(date):
+            self.totals[key] = self.totals.get(key, 0) + cents
+
+    def remove(self, date, cents):
+        self.add(date, -cents)
+
+    def total(self, period, date):
+        return self.totals.get((period, dict(period_keys(date))[period]), 0)
+
+    def save(self, file_path, signature):
+        """Write the totals with the store signature they were computed for."""
+        data = {
+            "signature": list(signature) if signature else None,
+            "totals": [[period, key, cents] for (period, key), cents in self.totals.items()],
+        }
+
+        temp_path = file_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, file_path)
+        fsync_directory(file_path)
+
+    def load(self, file_path, signature):
+        """Load saved totals, return False if they are missing or belong to another version of the store."""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("signature") != (list(signature) if signature else None):
+            return False
+
+        self.totals = {(period, key): cents for period, key, cents in data["totals"]}
+        return True
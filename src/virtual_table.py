@@ -0,0 +1,167 @@
+import array
+import itertools
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+from columns import index_array
+from instrumentation import metrics
+
+
+class VirtualTable:
+    """Windowed view over a ttk.Treeview.
+
+    Only the rows that fit on screen plus a small buffer are inserted into
+    the Treeview. The scrollbar is driven by our own offset into the full
+    row list, so the widget stays the same size however long the list is.
+    """
+
+    # Extra rows rendered below the visible area
+    buffer_rows = 10
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.style = ttk.Style(tree)
+        self.rows = []
+        self.row_values = None
+        self.row_ids = None
+        self.offset = 0
+        self.selected = set()
+        self.rendered = []
+
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind("<Configure>", lambda e: self.render())
+        self.tree.bind("<<TreeviewSelect>>", lambda e: self.update_selection())
+        # Returning "break" keeps the Treeview class bindings from scrolling the widget's own view
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units") or "break")
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units") or "break")
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units") or "break")
+        self.tree.bind("<Up>", lambda e: self.step(-1))
+        self.tree.bind("<Down>", lambda e: self.step(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages") or "break")
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages") or "break")
+
+    def set_rows(self, rows, row_values, row_ids=None):
+        """Show rows, row_values(row) returns the (iid, values) of one of them.
+
+        row_ids(rows), if given, returns the integer iids of all rows as a
+        NumPy array, so removing rows doesn't call row_values on each one.
+        """
+        self.rows = rows
+        self.row_values = row_values
+        self.row_ids = row_ids
+        self.offset = 0
+        self.selected = set()
+        self.render()
+
+    def clear(self):
+        self.set_rows([], None)
+
+    def append(self, row):
+        self.rows.append(row)
+
+        # Only redraw if the new row lands inside the window
+        if len(self.rows) - self.offset <= self.visible_rows() + self.buffer_rows:
+            self.render()
+        else:
+            self.update_scrollbar()
+
+    def remove(self, iids):
+        """Drop the rows with the given iids from the view."""
+        iids = set(iids)
+        if self.row_ids is None:
+            self.rows = [row for row in self.rows if self.row_values(row)[0] not in iids]
+        else:
+            keep = ~np.isin(self.row_ids(self.rows), np.array([int(iid) for iid in iids], dtype=np.int64))
+            if isinstance(self.rows, array.array):
+                self.rows = index_array(np.asarray(self.rows, dtype=np.int64)[keep])
+            else:
+                self.rows = list(itertools.compress(self.rows, keep.tolist()))
+        self.selected -= iids
+        self.offset = min(self.offset, self.max_offset())
+        self.render()
+
+    def selection(self):
+        return list(self.selected)
+
+    def visible_rows(self):
+        row_height = int(self.style.lookup("Treeview", "rowheight") or 20)
+        return max(1, self.tree.winfo_height() // row_height)
+
+    def max_offset(self):
+        return max(0, len(self.rows) - self.visible_rows())
+
+    @metrics.timed("table.render")
+    def render(self):
+        # Bulk delete instead of one Tcl call per item
+        if self.rendered:
+            self.tree.delete(*self.rendered)
+
+        window = self.rows[self.offset:self.offset + self.visible_rows() + self.buffer_rows]
+        self.rendered = []
+        for row in window:
+            iid, values = self.row_values(row)
+            self.tree.insert("", tk.END, iid=iid, values=values)
+            self.rendered.append(iid)
+
+        metrics.count("table.inserts", len(self.rendered))
+
+        # Restore the selection of rows scrolled back into view
+        visible_selection = [iid for iid in self.rendered if iid in self.selected]
+        if visible_selection:
+            self.tree.selection_set(visible_selection)
+
+        # The widget only holds the window, its own view always starts at the top
+        self.tree.yview_moveto(0)
+        self.update_scrollbar()
+
+    def update_scrollbar(self):
+        if not self.rows:
+            self.scrollbar.set(0.0, 1.0)
+            return
+
+        first = self.offset / len(self.rows)
+        last = min(1.0, (self.offset + self.visible_rows()) / len(self.rows))
+        self.scrollbar.set(first, last)
+
+    def update_selection(self):
+        rendered = set(self.rendered)
+        self.selected = (self.selected - rendered) | set(self.tree.selection())
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.move_to(int(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
+
+    def scroll(self, amount, what):
+        if what == "pages":
+            amount *= self.visible_rows()
+
+        self.move_to(self.offset + amount)
+
+    def step(self, amount):
+        """Move the focus one row up or down, scrolling when it leaves the window."""
+        focus = self.tree.focus()
+        if focus not in self.rendered:
+            return None
+
+        target = self.rendered.index(focus) + amount
+        if 0 <= target < min(self.visible_rows(), len(self.rendered)):
+            # Inside the window the Treeview moves the focus itself
+            return None
+
+        row = self.offset + target
+        self.scroll(amount, "units")
+        if self.rendered:
+            iid = self.rendered[max(0, min(row - self.offset, len(self.rendered) - 1))]
+            self.selected = {iid}
+            self.tree.focus(iid)
+            self.tree.selection_set(iid)
+        return "break"
+
+    def move_to(self, offset):
+        offset = max(0, min(offset, self.max_offset()))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
@@ -0,0 +1,33 @@
+import datetime
+import pytest
+from fast_parser import FastParser
+
+TODAY = datetime.date(2026, 10, 17)
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("spent 12.50 on lunch yesterday", ("2026-10-16", "lunch", "12.50", "USD")),
+    ("paid 20 for taxi today", ("2026-10-17", "taxi", "20", "USD")),
+    ("spent 9 on coffee last friday", ("2026-10-16", "coffee", "9", "USD")),
+    ("spent 5 on coffee this morning", ("2026-10-17", "coffee", "5", "USD")),
+    ("bought books for 30 on 2026-10-01", ("2026-10-01", "books", "30", "USD")),
+    ("€12,50 lunch", ("2026-10-17", "lunch", "12.50", "EUR")),
+])
+def test_understood_messages(message, expected):
+    assert FastParser().parse(message, TODAY) == expected
+
+
+@pytest.mark.parametrize("message", [
+    "paid 30 for groceries last month",
+    "spent 40 on dinner last week",
+    "paid 15 for taxi tomorrow",
+    "spent 12 on lunch next friday",
+    "spent 25 on gift for mom in march",
+    "paid 8 for parking 3 days ago",
+    "spent 60 on groceries this week",
+    "paid 100 for gym next year",
+])
+def test_unresolved_date_words_fall_back(message):
+    parser = FastParser()
+    assert parser.parse(message, TODAY) is None
+    assert parser.misses == 1
@@ -0,0 +1,76 @@
+import os
+import pytest
+from ledger import Ledger
+from storage import ExpenseStore
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # Rates and the legacy expenses.json are looked up in the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def open_ledger(path):
+    return Ledger(ExpenseStore(str(path)))
+
+
+def descriptions(ledger, deleted=False):
+    return [ledger.record(row)["description"] for row in ledger.view(deleted=deleted)[0]]
+
+
+def test_ledgers_on_one_log_see_each_others_adds(tmp_path):
+    path = tmp_path / "expenses.log"
+    first = open_ledger(path)
+    second = open_ledger(path)
+
+    first.add("2026-10-01", "lunch", "12.50")
+    second.add("2026-10-02", "tea", "3")
+
+    assert first.refresh()
+    assert descriptions(first) == ["lunch", "tea"]
+    assert descriptions(second) == ["lunch", "tea"]
+    # Ids never collide between writers
+    assert sorted(first.ids) == [1, 2]
+
+
+def test_compaction_by_another_ledger_is_picked_up(tmp_path):
+    path = tmp_path / "expenses.log"
+    first = open_ledger(path)
+    second = open_ledger(path)
+
+    expense_ids = first.add_many([("2026-10-01", "lunch", "12.50"), ("2026-10-02", "tea", "3"), ("2026-10-03", "taxi", "20")])
+    first.delete(expense_ids[1])
+    second.refresh()
+    inode = os.stat(path).st_ino
+
+    first.store.compact()
+    first.add("2026-10-04", "books", "30")
+
+    assert os.stat(path).st_ino != inode
+    assert second.refresh()
+    assert descriptions(second) == ["lunch", "taxi", "books"]
+    assert descriptions(second, deleted=True) == ["tea"]
+    assert second.store.version == first.store.version == 1
+
+    # Writing after the reload continues the ids of the compacted log
+    assert second.add("2026-10-05", "coffee", "4") == 5
+
+
+def test_snapshot_is_rejected_after_the_log_is_rewritten(tmp_path):
+    path = tmp_path / "expenses.log"
+    ledger = open_ledger(path)
+    ledger.add_many([("2026-10-01", "lunch", "12.50"), ("2026-10-02", "tea", "3")])
+    ledger.save_snapshot()
+
+    reopened = open_ledger(path)
+    assert reopened.snapshot_state is not None
+
+    # Another process rewrites the log with different records, same length and all
+    ledger.store.write_atomic([
+        {"op": "add", "id": 1, "date": "2026-10-01", "description": "bread", "amount": "12.50"},
+        {"op": "add", "id": 2, "date": "2026-10-02", "description": "milk", "amount": "3.00"},
+    ])
+
+    rewritten = open_ledger(path)
+    assert rewritten.snapshot_state is None
+    assert descriptions(rewritten) == ["bread", "milk"]
@@ -0,0 +1,50 @@
+import pytest
+from money import AMOUNT_PATTERN, find_amount, find_currency, format_cents, match_currency, normalize_amount, to_cents
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1,250.00", "1250.00"),
+    ("1.250,00", "1250.00"),
+    ("12,50", "12.50"),
+    ("12.50", "12.50"),
+    ("1,250", "1250"),
+    ("1.250.000", "1250000"),
+    ("30", "30"),
+])
+def test_normalize_amount(text, expected):
+    assert normalize_amount(text) == expected
+
+
+@pytest.mark.parametrize("message, amount, currency", [
+    ("rent 1,250.00", "1250.00", None),
+    ("€12,50 lunch", "12.50", "EUR"),
+    ("hotel 1.250,00 EUR", "1250.00", "EUR"),
+    ("$4.50 coffee", "4.50", "USD"),
+    ("taxi 20 quid", "20", "GBP"),
+    ("paid CHF 15 for parking", "15", "CHF"),
+    ("lunch 12.5", "12.5", None),
+])
+def test_amount_pattern(message, amount, currency):
+    match = find_amount(message)
+    assert normalize_amount(match.group("amount")) == amount
+    assert match_currency(match) == currency
+
+
+@pytest.mark.parametrize("message", ["no amount here", "route 66-b", "version 1.2.3"])
+def test_amount_pattern_ignores_non_amounts(message):
+    assert AMOUNT_PATTERN.search(message) is None
+
+
+def test_find_currency():
+    assert find_currency("12 on lunch in euros") == "EUR"
+    assert find_currency("12 on lunch") is None
+
+
+@pytest.mark.parametrize("amount, cents", [("12.50", 1250), ("1250.00", 125000), ("0.005", 1), (12.5, 1250), ("abc", 0), ("nan", 0)])
+def test_to_cents(amount, cents):
+    assert to_cents(amount) == cents
+
+
+def test_format_cents():
+    assert format_cents(125000) == "1250.00"
+    assert format_cents(-5) == "-0.05"
@@ -0,0 +1,45 @@
+import json
+import pytest
+from storage import CorruptLogError, ExpenseStore
+
+
+def write_log(path, lines):
+    path.write_bytes("".join(lines).encode("utf-8"))
+
+
+def add_line(expense_id, amount="12.50"):
+    return json.dumps({"op": "add", "id": expense_id, "date": "2026-10-01", "description": "lunch", "amount": amount}) + "\n"
+
+
+def test_torn_last_line_is_cut_off(tmp_path):
+    path = tmp_path / "expenses.log"
+    write_log(path, [add_line(1), add_line(2), '{"op": "add", "id": 3, "da'])
+
+    store = ExpenseStore(str(path))
+
+    assert sorted(store.records) == [1, 2]
+    assert path.read_bytes() == (add_line(1) + add_line(2)).encode("utf-8")
+
+    # The next id follows the last complete line and lands on a clean line
+    assert store.add("2026-10-02", "tea", "3") == 3
+    assert sorted(ExpenseStore(str(path)).records) == [1, 2, 3]
+
+
+def test_bad_middle_line_raises_and_leaves_the_file(tmp_path):
+    path = tmp_path / "expenses.log"
+    write_log(path, [add_line(1), "not json\n", add_line(2)])
+    before = path.read_bytes()
+
+    with pytest.raises(CorruptLogError):
+        ExpenseStore(str(path)).load()
+
+    assert path.read_bytes() == before
+
+
+def test_entry_missing_keys_is_unreadable(tmp_path):
+    path = tmp_path / "expenses.log"
+    write_log(path, ['{"op": "add", "id": 1}\n', add_line(2)])
+
+    with pytest.raises(CorruptLogError):
+        ExpenseStore(str(path)).load()
+